@@ -0,0 +1,85 @@
+import threading
+
+from wqdl.capture import AdaptiveWait, PageScheduler
+
+
+def run_with_timeout(func, seconds=5):
+    result = {}
+    thread = threading.Thread(target=lambda: result.setdefault("value", func()), daemon=True)
+    thread.start()
+    thread.join(seconds)
+    assert not thread.is_alive(), "调用卡住（可能死锁）"
+    return result["value"]
+
+
+def test_to_profile_without_samples():
+    profile = run_with_timeout(AdaptiveWait(settle=0.2, timeout=20).to_profile)
+    assert profile == {"settle": 0.2, "timeout": 20, "samples": []}
+
+
+def test_profile_round_trip():
+    controller = AdaptiveWait(settle=0.5)
+    for waited in (0.1, 0.2, 0.3, 0.4, 0.5, 0.6):
+        controller.observe(waited)
+    profile = run_with_timeout(controller.to_profile)
+
+    restored = AdaptiveWait.from_profile(profile)
+    assert restored.settle == controller.settle
+    assert list(restored.samples) == list(controller.samples)
+    assert restored.timeout == controller.timeout
+    assert run_with_timeout(restored.to_profile) == profile
+
+
+def test_idle_worker_takes_over_retired_worker_page():
+    scheduler = PageScheduler([1, 2], workers=2)
+    assert scheduler.next_page(0) == 1
+    assert scheduler.next_page(1) == 2
+
+    # worker 0 没有页面可领，但 worker 1 仍在截图，应等待而不是退出
+    taken = {}
+    waiter = threading.Thread(target=lambda: taken.setdefault(0, scheduler.next_page(0)), daemon=True)
+    waiter.start()
+    waiter.join(0.2)
+    assert waiter.is_alive()
+
+    scheduler.retire(1, RuntimeError("浏览器崩溃"), current_page=2)
+    waiter.join(5)
+    assert taken[0] == 2
+    scheduler.complete(2)
+    assert run_with_timeout(lambda: scheduler.next_page(0)) is None
+    assert scheduler.pending() == []
+
+
+def test_idle_worker_exits_when_others_finish():
+    scheduler = PageScheduler([1], workers=2)
+    assert scheduler.next_page(0) == 1
+    taken = {}
+    waiter = threading.Thread(target=lambda: taken.setdefault(1, scheduler.next_page(1)), daemon=True)
+    waiter.start()
+    assert run_with_timeout(lambda: scheduler.next_page(0)) is None
+    waiter.join(5)
+    assert taken[1] is None
+
+
+def test_backoff_is_additive_and_capped_by_ready_time():
+    controller = AdaptiveWait(backoff_step=0.05)
+    for _ in range(20):
+        controller.observe(0.3)
+    for _ in range(50):
+        controller.penalize()
+    assert controller.settle == 0.3
+
+    # 连续成功后逐渐恢复
+    for _ in range(30):
+        controller.observe(0.3)
+    assert controller.settle == 0.0
+
+
+def test_priority_pages_are_dispatched_first():
+    scheduler = PageScheduler(range(1, 11), workers=2, priority=[9, 5, 42])
+    assert scheduler.total == 10
+    assert [scheduler.next_page(0), scheduler.next_page(0)] == [5, 9]
+    rest = []
+    while (page := run_with_timeout(lambda: scheduler.next_page(0))) is not None:
+        rest.append(page)
+    assert sorted(rest) == [1, 2, 3, 4, 6, 7, 8, 10]
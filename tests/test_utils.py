@@ -0,0 +1,23 @@
+import json
+import multiprocessing
+
+from wqdl.utils import JsonProxy
+
+
+def update_in_child(path):
+    config = JsonProxy(path, "rw")
+    config.value = "child"
+
+
+def test_child_process_does_not_write(tmp_path):
+    path = str(tmp_path / "configs.json")
+    config = JsonProxy(path, "rw")
+    config.value = "parent"
+
+    process = multiprocessing.get_context("spawn").Process(target=update_in_child, args=(path,))
+    process.start()
+    process.join(30)
+    assert process.exitcode == 0
+
+    with open(path, encoding="utf-8") as f:
+        assert json.load(f) == {"value": "parent"}
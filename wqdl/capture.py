@@ -0,0 +1,496 @@
+import time
+import queue
+import threading
+from collections import deque
+from typing import Callable, Literal, Optional, Iterable, List, Dict
+
+# 页面图片可能的扩展名：截图为 png，网络抓取/压缩截图可能是 jpg、webp
+PAGE_IMAGE_EXTENSIONS = ("png", "jpg", "webp")
+
+def split_pages(
+    pages: Iterable[int],
+    workers: int,
+    mode: Literal["interleaved", "contiguous"] = "interleaved",
+) -> List[List[int]]:
+    """
+    将页面列表切分给 workers 个浏览器。
+    - interleaved: 交错分配（1,3,5... / 2,4,6...），各 worker 进度接近，已完成的页面更容易连成前缀
+    - contiguous: 连续区间分配，每个 worker 负责一段连续页面，滚动距离最短
+    """
+    pages = list(pages)
+    workers = max(1, min(workers, len(pages) or 1))
+    if mode == "contiguous":
+        size, rest = divmod(len(pages), workers)
+        shards, start = [], 0
+        for i in range(workers):
+            end = start + size + (1 if i < rest else 0)
+            shards.append(pages[start:end])
+            start = end
+        return shards
+    return [pages[i::workers] for i in range(workers)]
+
+
+class PageScheduler:
+    """
+    并行截图的页面调度器（线程安全）。
+
+    priority 中的页面最先派发（例如生成 PDF 时计算裁剪框的抽样页）。
+    每个 worker 优先处理自己的分片；自己的分片处理完后，先领取失效 worker 遗留的页面，
+    再从剩余最多的 worker 队尾“窃取”页面，保证各浏览器负载均衡。
+    暂时没有页面可领但其他 worker 还在截图时，空闲的 worker 等待，
+    以便接手之后失效 worker 遗留或校验未通过放回的页面。
+    某页彻底失败后，调度器不再派发比它更靠后的页面（之后的页面即使截取成功也无法生成连续的 PDF）。
+    """
+
+    def __init__(
+        self,
+        pages: Iterable[int],
+        workers: int = 1,
+        mode: Literal["interleaved", "contiguous"] = "interleaved",
+        priority: Iterable[int] = (),
+    ):
+        pages = list(pages)
+        self._priority: deque = deque(p for p in sorted(set(priority)) if p in pages)
+        shards = split_pages([p for p in pages if p not in self._priority], workers, mode)
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._queues: Dict[int, deque] = {i: deque(shard) for i, shard in enumerate(shards)}
+        self._orphans: deque = deque()
+        self._alive = set(self._queues)
+        self._busy: set = set()  # 正在截图（领到的页面尚未处理完）的 worker
+        self._limit: Optional[int] = None
+        self.total = len(self._priority) + sum(len(shard) for shard in shards)
+        self.completed: set = set()
+        self.failures: Dict[int, Exception] = {}
+        self.worker_errors: Dict[int, Exception] = {}
+        self.requeued: Dict[int, int] = {}
+
+    @property
+    def workers(self) -> int:
+        return len(self._queues)
+
+    def _take(self, q: deque, left: bool = True) -> Optional[int]:
+        while q:
+            page = q.popleft() if left else q.pop()
+            if self._limit is None or page < self._limit:
+                return page
+        return None
+
+    def next_page(self, worker_id: int) -> Optional[int]:
+        """
+        领取下一页（同时表示上一页已处理完）。暂时没有页面但其他 worker 仍在截图时等待，
+        所有页面都已派发且没有 worker 在截图时返回 None
+        """
+        with self._changed:
+            self._busy.discard(worker_id)
+            self._changed.notify_all()
+            while worker_id in self._alive:
+                page = self._take(self._priority)
+                if page is None:
+                    page = self._take(self._queues[worker_id])
+                if page is None:
+                    page = self._take(self._orphans)
+                if page is None:
+                    victims = [q for wid, q in self._queues.items() if wid in self._alive and q]
+                    if victims:
+                        page = self._take(max(victims, key=len), left=False)
+                if page is not None:
+                    self._busy.add(worker_id)
+                    return page
+                if not self._busy & self._alive:
+                    break
+                self._changed.wait()
+            return None
+
+    def peek(self, worker_id: int, count: int) -> List[int]:
+        """查看 worker 接下来要处理的 count 页（不领取），用于预加载"""
+        with self._lock:
+            q = self._queues.get(worker_id, ())
+            pages = [p for p in list(q)[:count] if self._limit is None or p < self._limit]
+            return pages
+
+    def claim(self, page: int) -> bool:
+        """
+        顺带领取一个尚未派发的页面（例如一次滚动中已经加载好的相邻页），
+        成功时该页从所有队列中移除，返回 True
+        """
+        with self._lock:
+            if self._limit is not None and page >= self._limit:
+                return False
+            for q in [self._priority, self._orphans, *self._queues.values()]:
+                if page in q:
+                    q.remove(page)
+                    return True
+            return False
+
+    def requeue(self, page: int) -> int:
+        """把页面放回队列（例如截图校验未通过），返回该页被放回的次数"""
+        with self._lock:
+            self.completed.discard(page)
+            self.requeued[page] = self.requeued.get(page, 0) + 1
+            self._orphans.append(page)
+            self._changed.notify_all()
+            return self.requeued[page]
+
+    def complete(self, page: int):
+        with self._lock:
+            self.completed.add(page)
+
+    def fail(self, page: int, error: Exception):
+        """某页重试后仍然失败：记录错误，并停止派发其后的页面"""
+        with self._lock:
+            self.failures[page] = error
+            if self._limit is None or page < self._limit:
+                self._limit = page
+
+    def retire(self, worker_id: int, error: Exception, current_page: Optional[int] = None) -> int:
+        """
+        worker 失效（浏览器崩溃、会话失效等），将其正在处理的页面和剩余页面交给其他 worker。
+        返回被重新分配的页面数
+        """
+        with self._lock:
+            self._alive.discard(worker_id)
+            self._busy.discard(worker_id)
+            self.worker_errors[worker_id] = error
+            q = self._queues[worker_id]
+            if current_page is not None:
+                self._orphans.appendleft(current_page)
+            self._orphans.extend(q)
+            count = len(q) + (current_page is not None)
+            q.clear()
+            self._changed.notify_all()
+            return count
+
+    def pending(self) -> List[int]:
+        """仍未完成（且未被放弃）的页面"""
+        with self._lock:
+            pages = set(self._orphans) | set(self._priority)
+            for q in self._queues.values():
+                pages.update(q)
+            if self._limit is not None:
+                pages = {p for p in pages if p < self._limit}
+            return sorted(pages)
+
+    def first_failure(self):
+        """返回 (页码, 错误)，没有失败页时返回 None"""
+        with self._lock:
+            if not self.failures:
+                return None
+            page = min(self.failures)
+            return page, self.failures[page]
+
+
+# 页面就绪检测脚本（execute_async_script 调用，参数：页码、超时毫秒数）。
+# 在页面内用 MutationObserver 监听 pageImgBox 中图片的出现与 src 变化，
+# 图片加载完成后 await img.decode() 并等待一帧布局，立即回调。
+# 一次调用完成 滚动 + 等待就绪 + 获取截图区域和图片地址，省去多次 WebDriver 往返。
+PAGE_READY_SCRIPT = """
+const pageNum = arguments[0], timeoutMs = arguments[1], done = arguments[arguments.length - 1];
+const start = performance.now();
+const selector = 'uni-view.page-lmg img';
+let finished = false, scrolled = false, observer = null, timer = null;
+
+function finish(ready, box, img) {
+    if (finished) return;
+    finished = true;
+    if (observer) observer.disconnect();
+    document.removeEventListener('load', check, true);
+    clearTimeout(timer);
+    const result = {ready: ready, waited: performance.now() - start};
+    if (ready) {
+        const r = box.getBoundingClientRect();
+        result.rect = {x: r.left + window.scrollX, y: r.top + window.scrollY, width: r.width, height: r.height};
+        result.src = img.currentSrc || img.src;
+    }
+    done(result);
+}
+
+function check() {
+    if (finished) return;
+    const box = document.getElementById('pageImgBox' + pageNum);
+    if (!box) return;
+    if (!scrolled) {
+        box.scrollIntoView({behavior: 'instant', block: 'center', inline: 'nearest'});
+        scrolled = true;
+    }
+    const img = box.querySelector(selector);
+    if (!img || !img.complete || !img.naturalWidth) return;
+    const decoded = img.decode ? img.decode() : Promise.resolve();
+    decoded.then(() => requestAnimationFrame(() => {
+        const rect = img.getBoundingClientRect();
+        if (rect.width > 0 && rect.height > 0) finish(true, box, img);
+    }), () => {});
+}
+
+observer = new MutationObserver(check);
+observer.observe(document.body, {childList: true, subtree: true, attributes: true, attributeFilter: ['src']});
+document.addEventListener('load', check, true);
+timer = setTimeout(() => finish(false), timeoutMs);
+check();
+"""
+
+
+# 预加载脚本（参数：接下来要截取的页码列表）。
+# 已加载的页面提前解码；未加载的页面取消懒加载并滚动到最远的一页，让阅读器提前开始下载，
+# 下一次截图时会重新滚动回当前页。返回已经加载完成的页码
+PREFETCH_SCRIPT = """
+const pages = arguments[0];
+const loaded = [];
+let target = null;
+for (const n of pages) {
+    const box = document.getElementById('pageImgBox' + n);
+    if (!box) continue;
+    const img = box.querySelector('uni-view.page-lmg img');
+    if (img && img.complete && img.naturalWidth) {
+        loaded.push(n);
+        if (img.decode) img.decode().catch(() => {});
+        continue;
+    }
+    if (img) {
+        img.loading = 'eager';
+        if (!img.getAttribute('src') && img.dataset.src) img.src = img.dataset.src;
+    }
+    target = box;
+}
+if (target) {
+    target.scrollIntoView({behavior: 'instant', block: 'center', inline: 'nearest'});
+    window.dispatchEvent(new Event('scroll'));
+}
+return loaded;
+"""
+
+
+# 恢复手段，按代价从低到高排列
+RECOVERY_TIERS = ("rescroll", "jump", "reload", "restart")
+RECOVERY_TIER_NAMES = {
+    "rescroll": "重新滚动",
+    "jump": "跳转到页面",
+    "reload": "刷新页面",
+    "restart": "重启浏览器",
+}
+
+# 重新滚动：先滚离再滚回目标页，重新触发阅读器的懒加载
+RESCROLL_SCRIPT = """
+const box = document.getElementById('pageImgBox' + arguments[0]);
+if (!box) return false;
+box.scrollIntoView({behavior: 'instant', block: 'start'});
+window.dispatchEvent(new Event('scroll'));
+box.scrollIntoView({behavior: 'instant', block: 'center'});
+window.dispatchEvent(new Event('scroll'));
+return true;
+"""
+
+# 跳转到页面：直接设置滚动容器的 scrollTop。目标页尚未渲染时按已渲染页面的高度估算位置
+JUMP_SCRIPT = """
+const n = arguments[0];
+const any = document.querySelector('[id^="pageImgBox"]');
+if (!any) return false;
+let el = any.parentElement;
+while (el && el !== document.body && el.scrollHeight <= el.clientHeight) el = el.parentElement;
+const container = (!el || el === document.body) ? document.scrollingElement : el;
+const box = document.getElementById('pageImgBox' + n);
+const first = parseInt(any.id.slice(10));
+const top = box ? box.offsetTop : any.offsetTop + (n - first) * any.offsetHeight;
+container.scrollTop = Math.max(0, top - container.clientHeight / 2 + (box ? box.offsetHeight / 2 : 0));
+container.dispatchEvent(new Event('scroll'));
+window.dispatchEvent(new Event('scroll'));
+return true;
+"""
+
+
+def prefetch_pages(driver, pages: List[int]) -> List[int]:
+    """让阅读器提前加载 pages 中的页面，返回其中已经加载完成的页码"""
+    if not pages:
+        return []
+    return driver.execute_script(PREFETCH_SCRIPT, pages) or []
+
+
+class CaptureStats:
+    """截图过程的计数与耗时统计（线程安全），截图结束时汇总显示"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters: Dict[str, float] = {}
+
+    def incr(self, name: str, value: float = 1) -> float:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+            return self.counters[name]
+
+    def maximum(self, name: str, value: float):
+        with self._lock:
+            self.counters[name] = max(self.counters.get(name, value), value)
+
+    def get(self, name: str, default: float = 0) -> float:
+        with self._lock:
+            return self.counters.get(name, default)
+
+
+class ImageWriter:
+    """
+    后台写盘：截图线程把图片字节放入有界队列后立即返回，由写盘线程完成原子写入和清单更新，
+    慢速磁盘、网络共享目录不再拖慢截图。队列满时截图线程阻塞等待（背压），
+    队列深度和阻塞时间计入统计
+    """
+
+    def __init__(
+        self,
+        write: Callable[..., None],
+        threads: int = 2,
+        depth: int = 16,
+        stats: Optional[CaptureStats] = None,
+    ):
+        self.write = write
+        self.stats = stats or CaptureStats()
+        self.queue: queue.Queue = queue.Queue(maxsize=max(1, depth))
+        self.errors: Dict[int, Exception] = {}
+        self.on_written: List[Callable[[int], None]] = []
+        self._threads = [
+            threading.Thread(target=self._run, daemon=True) for _ in range(max(1, threads))
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, page_num: int, data: bytes, ext: str, **fields):
+        start = time.time()
+        self.queue.put((page_num, data, ext, fields))
+        self.stats.incr("writer_blocked_seconds", time.time() - start)
+        self.stats.maximum("writer_queue_max", self.queue.qsize())
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                page_num, data, ext, fields = item
+                self.write(page_num, data, ext, **fields)
+                self.stats.incr("written_bytes", len(data))
+                for callback in self.on_written:
+                    callback(page_num)
+            except Exception as e:
+                self.errors[page_num] = e
+            finally:
+                self.queue.task_done()
+
+    def close(self):
+        """等待队列写完并结束写盘线程"""
+        self.queue.join()
+        for _ in self._threads:
+            self.queue.put(None)
+        for thread in self._threads:
+            thread.join()
+
+
+def wait_page_ready(driver, page_num: int, timeout: float) -> dict:
+    """
+    滚动到指定页并在浏览器内等待其图片解码完成，一次往返返回
+    {"waited": 等待秒数, "rect": 页面在文档中的矩形, "src": 图片地址}。
+    超时抛出 TimeoutError
+    """
+    res = driver.execute_async_script(PAGE_READY_SCRIPT, page_num, int(timeout * 1000))
+    if not res or not res.get("ready"):
+        raise TimeoutError(f"第 {page_num} 页图片在 {timeout} 秒内未加载完成")
+    res["waited"] = res["waited"] / 1000
+    return res
+
+
+class AdaptiveWait:
+    """
+    根据实际测得的页面就绪耗时自适应调整等待参数（线程安全），参数按域名保存，下次直接从调好的值开始。
+
+    - settle: 页面就绪后额外等待的秒数（关闭 event_ready 时即固定等待时间）。
+      截图校验失败或超时后增加 backoff_step，上限取就绪耗时的高分位数（不超过 max_settle）；
+      连续成功 shrink_after 页后开始缩短，连续成功越久缩短得越快
+    - timeout: 单页就绪的超时时间，取最近就绪耗时的高分位数乘以 timeout_factor，限制在 [min_timeout, max_timeout]
+    """
+
+    def __init__(
+        self,
+        settle: float = 0.0,
+        timeout: float = 20,
+        min_settle: float = 0.0,
+        max_settle: float = 3.0,
+        min_timeout: float = 5,
+        max_timeout: float = 60,
+        percentile: float = 95,
+        timeout_factor: float = 3,
+        shrink_after: int = 10,
+        window: int = 100,
+        backoff_step: float = 0.05,
+    ):
+        self._lock = threading.Lock()
+        self.settle = settle
+        self.base_timeout = timeout
+        self.min_settle = min_settle
+        self.max_settle = max_settle
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.percentile_value = percentile
+        self.timeout_factor = timeout_factor
+        self.shrink_after = shrink_after
+        self.backoff_step = backoff_step
+        self.samples: deque = deque(maxlen=window)
+        self.streak = 0
+        self.penalties = 0
+
+    @classmethod
+    def from_profile(cls, profile: Optional[dict], **defaults) -> "AdaptiveWait":
+        """从保存的参数恢复，没有保存过时使用默认值"""
+        controller = cls(**defaults)
+        if profile:
+            controller.settle = profile.get("settle", controller.settle)
+            controller.samples.extend(profile.get("samples", []))
+        return controller
+
+    def to_profile(self) -> dict:
+        timeout = self.timeout  # percentile() 自己加锁，必须在加锁之前读取
+        with self._lock:
+            return {
+                "settle": round(self.settle, 3),
+                "timeout": round(timeout, 3),
+                "samples": [round(x, 3) for x in list(self.samples)[-20:]],
+            }
+
+    def percentile(self, p: Optional[float] = None) -> Optional[float]:
+        """最近就绪耗时的 p 分位数（秒），样本不足时返回 None"""
+        with self._lock:
+            samples = sorted(self.samples)
+        if len(samples) < 5:
+            return None
+        p = self.percentile_value if p is None else p
+        return samples[min(len(samples) - 1, int(len(samples) * p / 100))]
+
+    @property
+    def timeout(self) -> float:
+        p = self.percentile()
+        if p is None:
+            return self.base_timeout
+        return min(self.max_timeout, max(self.min_timeout, p * self.timeout_factor))
+
+    def observe(self, waited: float):
+        """记录一次成功截图的就绪耗时，连续成功时按连续成功的页数缩短额外等待"""
+        with self._lock:
+            self.samples.append(waited)
+            self.streak += 1
+            if self.streak >= self.shrink_after:
+                shrink = self.backoff_step * self.streak / self.shrink_after
+                self.settle = max(self.min_settle, self.settle - shrink)
+                if self.settle < 0.01:
+                    self.settle = self.min_settle
+
+    def settle_limit(self) -> float:
+        """额外等待的上限：就绪耗时的高分位数（样本不足时为 max_settle），不小于 min_settle"""
+        p = self.percentile()
+        limit = self.max_settle if p is None else min(self.max_settle, max(p, 4 * self.backoff_step))
+        return max(self.min_settle, limit)
+
+    def penalize(self, timed_out: bool = False):
+        """截图校验失败或超时：额外等待增加 backoff_step；超时时同时放宽超时时间"""
+        limit = self.settle_limit()  # percentile() 自己加锁，必须在加锁之前读取
+        with self._lock:
+            self.streak = 0
+            self.penalties += 1
+            self.settle = min(limit, self.settle + self.backoff_step)
+            if timed_out:
+                self.samples.append(self.max_timeout / self.timeout_factor)
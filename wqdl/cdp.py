@@ -0,0 +1,223 @@
+import json
+import base64
+import weakref
+import urllib.parse
+from typing import Optional, Dict, List, Tuple
+
+# 可直接保存的图片类型 -> 扩展名
+IMAGE_MIME_EXTENSIONS = {
+    "image/jpeg": "jpg",
+    "image/jpg": "jpg",
+    "image/png": "png",
+    "image/webp": "webp",
+}
+
+# Page.captureScreenshot 的格式 -> 扩展名
+SCREENSHOT_FORMAT_EXTENSIONS = {"jpeg": "jpg", "png": "png", "webp": "webp"}
+
+# 返回元素在文档坐标系中的矩形，作为 Page.captureScreenshot 的裁剪区域
+ELEMENT_RECT_SCRIPT = """
+const el = document.getElementById(arguments[0]);
+if (!el) return null;
+const r = el.getBoundingClientRect();
+return {x: r.left + window.scrollX, y: r.top + window.scrollY, width: r.width, height: r.height};
+"""
+
+# 返回所有已加载完成的页面图片地址 {页码: src}
+PAGE_IMAGE_SOURCES_SCRIPT = """
+const result = {};
+document.querySelectorAll('[id^="pageImgBox"]').forEach(box => {
+    const img = box.querySelector('uni-view.page-lmg img');
+    if (img && img.complete && img.naturalWidth) result[box.id.slice(10)] = img.currentSrc || img.src;
+});
+return result;
+"""
+
+# 在页面内读取 blob: 地址的内容，以 data URL 形式返回
+BLOB_FETCH_SCRIPT = """
+const done = arguments[arguments.length - 1];
+fetch(arguments[0]).then(r => r.blob()).then(blob => {
+    const reader = new FileReader();
+    reader.onload = () => done(reader.result);
+    reader.onerror = () => done(null);
+    reader.readAsDataURL(blob);
+}).catch(() => done(null));
+"""
+
+
+def is_chromium(driver) -> bool:
+    """Chrome / Edge 驱动支持 DevTools 协议（CDP）"""
+    return hasattr(driver, "execute_cdp_cmd")
+
+
+def set_cookies(driver, cookies: List[dict]):
+    """
+    用 Network.setCookies 一次性写入整个 cookie 列表（selenium get_cookies() 的格式）。
+    不需要先打开目标网站，可以在第一次跳转之前调用
+    """
+    params = []
+    for cookie in cookies:
+        param = {
+            "name": cookie["name"],
+            "value": cookie["value"],
+            "domain": cookie.get("domain"),
+            "path": cookie.get("path", "/"),
+            "secure": cookie.get("secure", False),
+            "httpOnly": cookie.get("httpOnly", False),
+            "sameSite": cookie.get("sameSite"),
+            "expires": cookie.get("expiry"),
+        }
+        params.append({k: v for k, v in param.items() if v is not None})
+    driver.execute_cdp_cmd("Network.setCookies", {"cookies": params})
+
+
+def decode_data_url(url: str) -> Tuple[bytes, str]:
+    """解析 data URL，返回 (字节, MIME 类型)"""
+    header, _, data = url.partition(",")
+    mime = header[len("data:"):].split(";")[0]
+    if ";base64" in header:
+        return base64.b64decode(data), mime
+    return urllib.parse.unquote_to_bytes(data), mime
+
+
+def capture_screenshot(
+    driver,
+    clip: Dict[str, float],
+    fmt: str = "jpeg",
+    quality: int = 95,
+    beyond_viewport: bool = False,
+) -> bytes:
+    """
+    用 Page.captureScreenshot 截取 clip 区域，直接返回浏览器编码好的 jpeg / webp / png 字节，
+    省去 element.screenshot 的无损 PNG 编码和之后的解码再编码
+    """
+    params = {
+        "format": fmt,
+        "clip": {**clip, "scale": 1},
+        "captureBeyondViewport": beyond_viewport,
+    }
+    if fmt != "png":
+        params["quality"] = quality
+    return base64.b64decode(driver.execute_cdp_cmd("Page.captureScreenshot", params)["data"])
+
+
+def enable_network(driver):
+    # 加大响应缓冲区，避免图片内容在取回前被浏览器丢弃
+    driver.execute_cdp_cmd(
+        "Network.enable",
+        {"maxTotalBufferSize": 256 * 1024 * 1024, "maxResourceBufferSize": 32 * 1024 * 1024},
+    )
+
+
+def block_urls(driver, patterns: List[str]):
+    """用 Network.setBlockedURLs 屏蔽匹配的请求（支持 * 通配符），对该浏览器之后的所有页面生效"""
+    enable_network(driver)
+    driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": list(patterns)})
+
+
+class NetworkMonitor:
+    """
+    读取浏览器的 performance 日志（需开启 goog:loggingPrefs / ms:loggingPrefs），
+    记录已下载的图片响应，并统计请求数、被屏蔽的请求数和下载字节数。
+    每个浏览器只有一个实例（日志读取后即被清空，不能由多处分别读取）
+    """
+
+    _monitors = weakref.WeakKeyDictionary()
+
+    @classmethod
+    def for_driver(cls, driver) -> "NetworkMonitor":
+        monitor = cls._monitors.get(driver)
+        if monitor is None:
+            monitor = cls._monitors[driver] = cls(driver)
+        return monitor
+
+    def __init__(self, driver):
+        self.driver = driver
+        self.image_responses: Dict[str, Tuple[str, str]] = {}  # url -> (requestId, mimeType)
+        self.requests = 0
+        self.blocked = 0
+        self.downloaded_bytes = 0
+
+    def poll(self):
+        for entry in self.driver.get_log("performance"):
+            message = json.loads(entry["message"]).get("message", {})
+            method = message.get("method")
+            params = message.get("params", {})
+            if method == "Network.requestWillBeSent":
+                self.requests += 1
+            elif method == "Network.loadingFinished":
+                self.downloaded_bytes += int(params.get("encodedDataLength", 0))
+            elif method == "Network.loadingFailed":
+                if params.get("blockedReason"):
+                    self.blocked += 1
+            elif method == "Network.responseReceived":
+                response = params["response"]
+                if response.get("mimeType", "").startswith("image/"):
+                    self.image_responses[response["url"]] = (
+                        params["requestId"],
+                        response["mimeType"],
+                    )
+
+    def snapshot(self) -> Dict[str, int]:
+        self.poll()
+        return {
+            "requests": self.requests,
+            "blocked": self.blocked,
+            "downloaded_bytes": self.downloaded_bytes,
+        }
+
+
+class NetworkImageHarvester:
+    """
+    通过 DevTools 协议直接获取阅读器下载的原始页面图片，代替 element.screenshot。
+
+    从 performance 日志中的 Network.responseReceived 事件记录图片 URL 对应的 requestId，
+    再用 Network.getResponseBody 取回原始字节。data: / blob: 地址则在页面内直接读取。
+    """
+
+    def __init__(self, driver):
+        self.driver = driver
+        self.monitor = NetworkMonitor.for_driver(driver)
+        self.responses = self.monitor.image_responses
+        enable_network(driver)
+
+    def poll(self):
+        """读取 performance 日志，记录新下载的图片响应"""
+        self.monitor.poll()
+
+    def page_sources(self) -> Dict[int, str]:
+        """当前已加载完成的页面图片地址 {页码: src}"""
+        sources = self.driver.execute_script(PAGE_IMAGE_SOURCES_SCRIPT) or {}
+        return {int(k): v for k, v in sources.items() if k.isdigit() and v}
+
+    def fetch(self, src: str) -> Optional[Tuple[bytes, str]]:
+        """
+        取回图片原始字节，返回 (字节, 扩展名)；取不到或格式不支持时返回 None，由调用方回退到截图
+        """
+        if src.startswith("blob:"):
+            src = self.driver.execute_async_script(BLOB_FETCH_SCRIPT, src)
+            if not src:
+                return None
+        if src.startswith("data:"):
+            data, mime = decode_data_url(src)
+        else:
+            self.poll()
+            if src not in self.responses:
+                return None
+            request_id, mime = self.responses[src]
+            try:
+                body = self.driver.execute_cdp_cmd(
+                    "Network.getResponseBody", {"requestId": request_id}
+                )
+            except Exception:
+                # 页面重新加载后旧的 requestId 会失效
+                self.responses.pop(src, None)
+                return None
+            if body.get("base64Encoded"):
+                data = base64.b64decode(body["body"])
+            else:
+                data = body["body"].encode("utf-8")
+        ext = IMAGE_MIME_EXTENSIONS.get(mime.lower())
+        if ext is None or not data:
+            return None
+        return data, ext
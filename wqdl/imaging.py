@@ -0,0 +1,201 @@
+import io
+import numpy as np
+from PIL import Image
+from typing import List, Optional, Sequence, Tuple, Union
+
+THUMB_SIZE = 256  # 校验时将图片缩小到该尺寸以内
+PAGE_HASH_SIZE = 16  # 页面感知哈希的边长（16x16 共 256 位，64 位对文字密集的页面区分度不够）
+
+
+def load_gray(source: Union[str, bytes], size: int = THUMB_SIZE) -> np.ndarray:
+    """读取图片为缩小后的灰度数组（JPEG 使用 draft 模式，只解码需要的分辨率）"""
+    with Image.open(io.BytesIO(source) if isinstance(source, bytes) else source) as img:
+        img.draft("L", (size, size))
+        img = img.convert("L")
+        img.thumbnail((size, size))
+        return np.asarray(img, dtype=np.uint8)
+
+
+def image_entropy(gray: np.ndarray) -> float:
+    """灰度直方图的信息熵（比特）"""
+    hist = np.bincount(gray.ravel(), minlength=256).astype(np.float64)
+    p = hist[hist > 0] / gray.size
+    return float(-(p * np.log2(p)).sum())
+
+
+def dhash(gray: np.ndarray, hash_size: int = 8) -> int:
+    """差值感知哈希（dHash），内容相同或相近的页面哈希的汉明距离很小"""
+    img = Image.fromarray(gray).resize((hash_size + 1, hash_size), Image.BILINEAR)
+    a = np.asarray(img, dtype=np.int16)
+    bits = (a[:, 1:] > a[:, :-1]).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def check_page_image(
+    gray: np.ndarray,
+    min_std: float = 1.0,
+    min_entropy: float = 0.01,
+) -> Optional[str]:
+    """
+    检查截图是否正常，返回问题描述；正常时返回 None。
+    - 几乎纯色：空白页或加载中的占位图
+    - 信息熵过低：只有零星几个像素不同
+    - 下半部分是与页面背景不同的纯色带：图片只解码/渲染了一部分
+    """
+    if float(gray.std()) < min_std:
+        return "几乎是纯色（空白或加载中的占位图）"
+    if image_entropy(gray) < min_entropy:
+        return "信息量过低（可能未渲染完成）"
+
+    # 从底部开始连续的纯色行
+    flat = gray.std(axis=1) < 0.5
+    tail = int(np.argmax(~flat[::-1]))
+    if tail > gray.shape[0] // 3:
+        band = float(gray[-tail:].mean())
+        background = float(np.median(gray[:-tail]))
+        if abs(band - background) > 8:
+            return "下半部分未渲染完成"
+    return None
+
+
+def otsu_threshold(hist: np.ndarray) -> int:
+    """按灰度直方图计算使类间方差最大的二值化阈值（Otsu）"""
+    hist = hist.astype(np.float64)
+    levels = np.arange(hist.size)
+    weight = np.cumsum(hist)
+    mean = np.cumsum(hist * levels)
+    total = weight[-1]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        between = (mean[-1] * weight - mean * total) ** 2 / (weight * (total - weight))
+    return int(np.nanargmax(between[:-1])) if total else 128
+
+
+def classify_page(
+    img: Image.Image,
+    chroma_tolerance: int = 24,
+    color_ratio: float = 0.002,
+    midtone_ratio: float = 0.35,
+):
+    """
+    按直方图判断页面类型，返回 (类型, 灰度直方图)：
+    - color：超过 color_ratio 的像素明显偏离灰色
+    - bilevel：深色像素中的中间调（抗锯齿、灰色图）不足 midtone_ratio，即黑白文字页
+    - gray：其余页面
+    """
+    if img.mode not in ("1", "L"):
+        small = img.copy()
+        small.thumbnail((THUMB_SIZE * 2, THUMB_SIZE * 2))
+        rgb = np.asarray(small.convert("RGB"), dtype=np.int16)
+        if ((rgb.max(axis=2) - rgb.min(axis=2)) > chroma_tolerance).mean() > color_ratio:
+            return "color", None
+    hist = np.bincount(np.asarray(img.convert("L")).ravel(), minlength=256)
+    ink = hist[:192].sum()
+    if ink == 0 or hist[64:192].sum() / ink < midtone_ratio:
+        return "bilevel", hist
+    return "gray", hist
+
+
+Box = Tuple[float, float, float, float]  # 相对坐标 (left, top, right, bottom)
+
+
+def ink_bbox(gray: np.ndarray, tolerance: int = 24, min_ink: float = 0.002) -> Optional[Box]:
+    """
+    按行、列的墨迹投影找出内容区域，返回相对坐标；没有内容时返回 None。
+    背景色取图片四周边框的中位数，与背景相差超过 tolerance 的像素视为墨迹，
+    墨迹像素占比不超过 min_ink 的行、列视为空白（忽略噪点和 JPEG 伪影）
+    """
+    h, w = gray.shape
+    frame = np.concatenate([gray[0], gray[-1], gray[:, 0], gray[:, -1]])
+    ink = np.abs(gray.astype(np.int16) - int(np.median(frame))) > tolerance
+    rows = np.flatnonzero(ink.mean(axis=1) > min_ink)
+    cols = np.flatnonzero(ink.mean(axis=0) > min_ink)
+    if rows.size == 0 or cols.size == 0:
+        return None
+    return (cols[0] / w, rows[0] / h, (cols[-1] + 1) / w, (rows[-1] + 1) / h)
+
+
+def stable_crop_box(
+    boxes: Sequence[Optional[Box]], margin: float = 0.01, min_saving: float = 0.02
+) -> Optional[Box]:
+    """
+    由抽样页面的内容区域得到整本书统一的裁剪框：各边取中位数（不受封面、插页影响）再留出 margin。
+    裁掉的面积不足 min_saving 时返回 None
+    """
+    boxes = np.array([box for box in boxes if box is not None], dtype=np.float64)
+    if boxes.size == 0:
+        return None
+    left, top, right, bottom = np.median(boxes, axis=0)
+    box = (
+        max(0.0, left - margin),
+        max(0.0, top - margin),
+        min(1.0, right + margin),
+        min(1.0, bottom + margin),
+    )
+    if (box[2] - box[0]) * (box[3] - box[1]) > 1 - min_saving:
+        return None
+    return tuple(float(v) for v in box)
+
+
+def crop_to_box(img: Image.Image, box: Box, tolerance: int = 24) -> Optional[Image.Image]:
+    """按相对坐标裁剪页面；该页内容超出裁剪框（如满版插图）时不裁剪，返回 None"""
+    small = img.convert("L")
+    small.thumbnail((THUMB_SIZE * 2, THUMB_SIZE * 2))
+    bbox = ink_bbox(np.asarray(small, dtype=np.uint8), tolerance)
+    if bbox is not None and (
+        bbox[0] < box[0] or bbox[1] < box[1] or bbox[2] > box[2] or bbox[3] > box[3]
+    ):
+        return None
+    w, h = img.size
+    return img.crop(
+        (round(box[0] * w), round(box[1] * h), round(box[2] * w), round(box[3] * h))
+    )
+
+
+def sample_indices(count: int, samples: int) -> List[int]:
+    """从 count 个元素中均匀抽取至多 samples 个的下标"""
+    step = max(1, count // max(1, samples))
+    return list(range(0, count, step))[:samples]
+
+
+def sample_crop_box(
+    paths: List[str], samples: int = 24, tolerance: int = 24, margin: float = 0.01
+) -> Optional[Box]:
+    """从页面中均匀抽取 samples 张计算整本书的裁剪框"""
+    boxes = [
+        ink_bbox(load_gray(paths[i], THUMB_SIZE * 2), tolerance)
+        for i in sample_indices(len(paths), samples)
+    ]
+    return stable_crop_box(boxes, margin)
+
+
+def _box_mean(x: np.ndarray, size: int) -> np.ndarray:
+    """用积分图计算每个 size x size 窗口的均值"""
+    c = np.zeros((x.shape[0] + 1, x.shape[1] + 1), dtype=np.float64)
+    c[1:, 1:] = x.cumsum(axis=0, dtype=np.float64).cumsum(axis=1)
+    return (c[size:, size:] - c[:-size, size:] - c[size:, :-size] + c[:-size, :-size]) / (size * size)
+
+
+def ssim(a: np.ndarray, b: np.ndarray, window: int = 8, stride: int = 1) -> float:
+    """
+    两张同样大小的灰度图的平均结构相似度（SSIM，均匀窗口）。
+    stride > 1 时只取每 stride 个 32 行宽的横条计算，速度更快
+    """
+    if stride > 1 and a.shape[0] >= 32 * stride:
+        rows = (np.arange(a.shape[0]) // 32) % stride == 0
+        a, b = a[rows], b[rows]
+    window = min(window, *a.shape)
+    a = a.astype(np.float32)
+    b = b.astype(np.float32)
+    c1, c2 = (0.01 * 255) ** 2, (0.03 * 255) ** 2
+    mu_a, mu_b = _box_mean(a, window), _box_mean(b, window)
+    var_a = _box_mean(a * a, window) - mu_a**2
+    var_b = _box_mean(b * b, window) - mu_b**2
+    cov = _box_mean(a * b, window) - mu_a * mu_b
+    s = ((2 * mu_a * mu_b + c1) * (2 * cov + c2)) / (
+        (mu_a**2 + mu_b**2 + c1) * (var_a + var_b + c2)
+    )
+    return float(s.mean())
@@ -1,5 +1,4 @@
 import os
-import io
 import re
 import sys
 import json
@@ -8,6 +7,9 @@ import fitz
 import shutil
 import logging
 import datetime
+import threading
+import multiprocessing
+from concurrent.futures import Future, ThreadPoolExecutor
 import requests
 import subprocess
 import urllib.parse
@@ -15,7 +17,6 @@ import traceback
 import webbrowser
 import platform
 import flet as ft
-from PIL import Image
 from requests.exceptions import HTTPError
 from typing import Literal, Optional, TypedDict, List
 from selenium import webdriver
@@ -42,6 +43,49 @@ from wqdl.webdriver_manager.chrome import ChromeDriverManager
 from wqdl.webdriver_manager.firefox import GeckoDriverManager
 from wqdl.webdriver_manager.microsoft import EdgeChromiumDriverManager
 from wqdl.utils import JsonProxy
+from wqdl.capture import (
+    JUMP_SCRIPT,
+    PAGE_IMAGE_EXTENSIONS,
+    RECOVERY_TIERS,
+    RECOVERY_TIER_NAMES,
+    RESCROLL_SCRIPT,
+    AdaptiveWait,
+    CaptureStats,
+    ImageWriter,
+    PageScheduler,
+    prefetch_pages,
+    wait_page_ready,
+)
+from wqdl.session_pool import DriverPool
+from wqdl.profiles import BrowserProfileManager
+from wqdl.manifest import PageManifest
+from wqdl.pdf import (
+    ENCODE_PARAMS,
+    ChunkedPdfBuilder,
+    PdfBuilder,
+    PdfPatcher,
+    StreamingPdfBuilder,
+    flatten_toc,
+)
+from wqdl.imaging import (
+    PAGE_HASH_SIZE,
+    load_gray,
+    check_page_image,
+    dhash,
+    hamming,
+    sample_indices,
+    ssim,
+)
+from wqdl.cdp import (
+    ELEMENT_RECT_SCRIPT,
+    SCREENSHOT_FORMAT_EXTENSIONS,
+    NetworkImageHarvester,
+    NetworkMonitor,
+    block_urls,
+    capture_screenshot,
+    is_chromium,
+    set_cookies,
+)
 
 
 class ChromeDriverManagerConfig(TypedDict):
@@ -89,7 +133,45 @@ class WQDLConfig(JsonProxy):
             url="https://msedgedriver.azureedge.net",
             latest_release_url="https://msedgedriver.azureedge.net/LATEST_RELEASE",
         )
-        self.screenshot_wait = 0.5
+        self.screenshot_wait = 0.5  # 仅在 event_ready 关闭时使用的固定等待
+        self.event_ready = True  # 在页面内监听图片解码完成，代替固定等待
+        self.page_ready_timeout = 20  # 单页最长等待时间（秒）
+        self.adaptive_wait = True  # 根据实测的页面就绪耗时自动调整等待时间
+        self.prefetch_window = 2  # 截图当前页时让阅读器提前加载之后的几页（0 为关闭）
+        self.writer_threads = 2  # 后台写盘线程数
+        self.writer_queue_depth = 16  # 等待写盘的图片数上限，写盘跟不上时截图暂停等待
+        self.block_resources = True  # 截图时屏蔽字体、统计脚本等与页面图片无关的资源（登录时不屏蔽）
+        self.browser_profile = True  # 截图浏览器使用持久化的配置目录和磁盘缓存，重复启动时命中本地缓存
+        self.browser_profile_dir = "./browser_profiles"
+        self.browser_profile_max_mb = 512  # 每种浏览器的配置目录和缓存总大小上限（MB）
+        self.blocked_url_patterns = [
+            "*.woff",
+            "*.woff2",
+            "*.ttf",
+            "*.otf",
+            "*.mp3",
+            "*.mp4",
+            "*hm.baidu.com*",
+            "*cnzz.com*",
+            "*google-analytics.com*",
+            "*googletagmanager.com*",
+            "*doubleclick.net*",
+        ]
+        self.wait_profiles = {}  # 按域名保存的自适应等待参数（自动维护）
+        self.capture_backend = "screenshot"  # screenshot 截图 / network 直接保存原始页面图片（仅 Chrome、Edge）
+        self.cdp_screenshot = True  # Chrome、Edge 使用 Page.captureScreenshot 截图，直接得到压缩后的图片
+        self.screenshot_format = "jpeg"  # jpeg / webp / png
+        self.screenshot_quality = 95  # jpeg / webp 的质量
+        self.capture_beyond_viewport = False  # 页面超出视口时也完整截取
+        self.session_pool = True  # 批量下载多本书（多卷）时复用已登录的浏览器
+        self.session_max_uses = 20  # 每个浏览器最多复用的次数，之后回收重建
+        self.manifest_verify_hash = True  # 断点续传时校验已保存图片的哈希
+        self.validate_pages = True  # 检查截图是否空白、未渲染完成或与相邻页重复，有问题时自动重新截取
+        self.validate_retries = 2  # 每页因校验未通过而重新截取的最多次数（之后视为确实如此，例如空白页）
+        self.duplicate_hash_distance = 16  # 与相邻页感知哈希（256 位）的汉明距离不超过该值时再比对像素
+        self.duplicate_ssim = 0.98  # 与相邻页缩略图的结构相似度不低于该值时视为重复
+        self.capture_workers = 1  # 并行截图的浏览器数量
+        self.capture_shard_mode = "interleaved"  # 页面分配方式：interleaved 交错 / contiguous 连续区间
         self.download_dir = "./downloads"
         self.user_agent = "Mozilla/5.0 (iPhone; CPU iPhone OS 14_6 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/14.0.3 Mobile/15E148 Safari/604.1"
         self.login_window_size = (300, 1100)
@@ -110,6 +192,18 @@ class WQDLConfig(JsonProxy):
         self.username = ""
         self.password = ""
         self.pdf_quality = 100
+        self.stream_pdf = True  # 截图的同时在后台按页码顺序生成 PDF
+        self.pdf_workers = 0  # 并行编码页面图片的进程数（0 为 CPU 核心数）
+        self.pdf_target_mb = 0  # 目标 PDF 大小（MB），按每页内容分配 JPEG 质量，pdf_quality 为最高质量（0 为关闭）
+        self.pdf_target_kb_per_page = 0  # 按每页平均大小（KB）指定目标大小，pdf_target_mb 为 0 时使用
+        self.pdf_min_ssim = 0.95  # 目标大小模式下每页与原图的结构相似度（SSIM）下限
+        self.pdf_chunk_pages = 100  # 生成 PDF 时每隔多少页保存一次，内存占用与页数无关，中断后可继续（0 为关闭）
+        self.pdf_encoding = "auto"  # auto 按页面内容选择彩色 JPEG / 灰度 JPEG / 黑白 G4 编码，gray 不使用黑白编码，rgb 全部彩色 JPEG
+        self.bilevel_midtone_ratio = 0.35  # 深色像素中的中间调比例低于该值的灰度页面视为黑白文字页
+        self.pdf_auto_crop = True  # 生成 PDF 时裁去页边空白和截图边框（整本书使用统一的裁剪框）
+        self.crop_sample_pages = 24  # 计算裁剪框时在整本书中均匀抽样的页数
+        self.crop_tolerance = 24  # 与背景色相差超过该值的像素视为内容
+        self.crop_margin = 0.01  # 裁剪框四周保留的边距（占页面宽高的比例）
         self.clean_up = False
         self.starred = False
         super().__init__(json_file, mode, save_after_change_count)
@@ -125,6 +219,11 @@ DOWNLOAD_DIR = wqdlconfig.download_dir
 REPO_URL = "https://github.com/Qalxry/WQBookDownloader"
 LATEST_RELEASE_URL = "https://github.com/Qalxry/WQBookDownloader/releases/latest"
 
+# 截图浏览器的持久化配置目录（所有下载任务共用，保证同一目录同时只被一个浏览器使用）
+browser_profiles = BrowserProfileManager(
+    wqdlconfig.browser_profile_dir, wqdlconfig.browser_profile_max_mb
+)
+
 # 一些常量
 BUTTON_HEIGHT = 60
 BOOK_ITEM_HEIGHT = 150
@@ -739,15 +838,27 @@ class WQBookDownloaderGUI:
             e.control.disabled = False
             self.page.update()
             return
+        # 同一批下载的书籍（多卷）复用已登录的浏览器
+        pool = (
+            DriverPool(
+                max_uses=wqdlconfig.session_max_uses,
+                max_idle=max(1, wqdlconfig.capture_workers),
+            )
+            if wqdlconfig.session_pool
+            else None
+        )
         try:
             for item in self.book_data_list:
                 if item["cbox"].value:
-                    download_book(self, item)
+                    download_book(self, item, pool)
         except Exception as err:
             self.query_commit_issue(err)
             e.control.disabled = False
             self.page.update()
             return
+        finally:
+            if pool is not None:
+                pool.close()
         self.print_info("下载完成")
         res = self.query_user("提示", "下载完成，是否打开下载文件夹？")
         if res == "是":
@@ -849,8 +960,15 @@ class WQBookDownloaderGUI:
 
 
 class WQBookDownloader:
-    def __init__(self, book: dict, gui_handler, download_dir: str = "./downloads"):
+    def __init__(
+        self,
+        book: dict,
+        gui_handler,
+        download_dir: str = "./downloads",
+        pool: Optional[DriverPool] = None,
+    ):
         self.driver = None
+        self.pool = pool
         self.book = book
         self.download_dir = download_dir
         self.book_dir = os.path.join(
@@ -861,6 +979,14 @@ class WQBookDownloader:
         os.makedirs(self.download_dir, exist_ok=True)
         os.makedirs(self.book_dir, exist_ok=True)
         os.makedirs(self.image_dir, exist_ok=True)
+        # 页面清单：记录每页图片的大小、哈希等信息，用于可靠的断点续传
+        self.manifest = PageManifest(
+            os.path.join(self.book_dir, "manifest.json"),
+            self.image_dir,
+            verify_hash=wqdlconfig.manifest_verify_hash,
+        )
+        self.pdf_stream: Optional[StreamingPdfBuilder] = None  # 与截图并行生成的 PDF
+        self.catalog_future: Optional[Future] = None  # 与截图并行下载的目录数据
 
     # Step 1-2 / 2-1
     @show_log
@@ -869,12 +995,42 @@ class WQBookDownloader:
         headless=False,
         window_size: Literal["maximized", "mobile"] = "maximized",
     ):
+        self.driver = self.create_driver(headless=headless, window_size=window_size)
+        return self.driver
+
+    @show_log
+    def create_driver(
+        self,
+        headless=False,
+        window_size: Literal["maximized", "mobile"] = "maximized",
+        block_resources=False,
+        profile_slot: Optional[str] = None,
+    ) -> webdriver.Remote:
+        """
+        创建一个新的浏览器驱动并返回，不会修改 self.driver（并行截图的 worker 各自持有一个）。
+        block_resources 为 True 时屏蔽 blocked_url_patterns 中的资源（仅用于截图，登录时不屏蔽）；
+        profile_slot 为持久化配置目录的槽位（见 BrowserProfileManager）
+        """
+        # 每个槽位的磁盘缓存上限，并行的 worker 平分总大小
+        cache_size = (
+            wqdlconfig.browser_profile_max_mb
+            * 1024
+            * 1024
+            // max(1, wqdlconfig.capture_workers)
+        )
+        performance_log = wqdlconfig.capture_backend == "network" or block_resources
         browserType = self.gui.get_browser_type()
         if browserType == "Chrome":
             options = ChromeOptions()
             options.add_argument("--disable-gpu")
             options.add_argument("--no-sandbox")
             options.add_argument(f"--user-agent={wqdlconfig.user_agent}")
+            if performance_log:
+                options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
+            if profile_slot is not None:
+                options.add_argument(f"--user-data-dir={os.path.join(profile_slot, 'profile')}")
+                options.add_argument(f"--disk-cache-dir={os.path.join(profile_slot, 'cache')}")
+                options.add_argument(f"--disk-cache-size={cache_size}")
             if headless:
                 options.add_argument("--headless=new")
                 options.add_argument(
@@ -918,7 +1074,7 @@ class WQBookDownloader:
                         driver_manager.set_browser_version_manually(browser_path)
                     else:
                         raise e
-            self.driver = webdriver.Chrome(
+            driver = webdriver.Chrome(
                 service=ChromeService(driver_manager.get_driver_path()),
                 options=options,
             )
@@ -926,6 +1082,14 @@ class WQBookDownloader:
         elif browserType == "Firefox":
             options = FirefoxOptions()
             options.set_preference("general.useragent.override", wqdlconfig.user_agent)
+            if block_resources:
+                # Firefox 不支持 CDP 屏蔽请求，只能关闭网页字体
+                options.set_preference("gfx.downloadable_fonts.enabled", False)
+            if profile_slot is not None:
+                options.add_argument("-profile")
+                options.add_argument(os.path.join(profile_slot, "profile"))
+                options.set_preference("browser.cache.disk.smart_size.enabled", False)
+                options.set_preference("browser.cache.disk.capacity", cache_size // 1024)
             if headless:
                 options.add_argument("-headless")
                 options.set_preference(
@@ -965,17 +1129,23 @@ class WQBookDownloader:
                         driver_manager.set_browser_version_manually(browser_path)
                     else:
                         raise e
-            self.driver = webdriver.Firefox(
+            driver = webdriver.Firefox(
                 service=FirefoxService(driver_manager.get_driver_path()),
                 options=options,
             )
-            self.driver.maximize_window()
+            driver.maximize_window()
 
         elif browserType == "Edge":
             options = EdgeOptions()
             options.add_argument("--disable-gpu")
             options.add_argument("--no-sandbox")
             options.add_argument(f"--user-agent={wqdlconfig.user_agent}")
+            if performance_log:
+                options.set_capability("ms:loggingPrefs", {"performance": "ALL"})
+            if profile_slot is not None:
+                options.add_argument(f"--user-data-dir={os.path.join(profile_slot, 'profile')}")
+                options.add_argument(f"--disk-cache-dir={os.path.join(profile_slot, 'cache')}")
+                options.add_argument(f"--disk-cache-size={cache_size}")
             if headless:
                 options.add_argument("--headless=new")
                 options.add_argument(
@@ -1015,18 +1185,67 @@ class WQBookDownloader:
                     else:
                         raise e
 
-            self.driver = webdriver.Edge(
+            driver = webdriver.Edge(
                 service=EdgeService(driver_manager.get_driver_path()),
                 options=options,
             )
 
         if window_size == "mobile":
-            self.driver.set_window_size(*wqdlconfig.login_window_size)
-            # self.driver.set_window_size(300, 1100)
+            driver.set_window_size(*wqdlconfig.login_window_size)
+            # driver.set_window_size(300, 1100)
         elif window_size == "maximized":
-            self.driver.set_window_size(*wqdlconfig.capture_window_size)
-            # self.driver.set_window_size(1080, 1920)
-            # print(self.driver.get_window_size())
+            driver.set_window_size(*wqdlconfig.capture_window_size)
+            # driver.set_window_size(1080, 1920)
+            # print(driver.get_window_size())
+        # 页面就绪检测脚本在浏览器内最多等待的时间（自适应超时最多放宽到 60 秒）
+        driver.set_script_timeout(max(60, wqdlconfig.page_ready_timeout) + 5)
+        if block_resources and is_chromium(driver):
+            block_urls(driver, wqdlconfig.blocked_url_patterns)
+        return driver
+
+    def create_capture_driver(self):
+        """创建截图用的浏览器：屏蔽无关资源，并使用持久化的配置目录和磁盘缓存"""
+        if not wqdlconfig.browser_profile:
+            return self.create_driver(
+                headless=wqdlconfig.capture_headless,
+                window_size="maximized",
+                block_resources=wqdlconfig.block_resources,
+            )
+        slot = browser_profiles.acquire(self.gui.get_browser_type())
+        try:
+            driver = self.create_driver(
+                headless=wqdlconfig.capture_headless,
+                window_size="maximized",
+                block_resources=wqdlconfig.block_resources,
+                profile_slot=slot,
+            )
+        except Exception:
+            browser_profiles.release(slot)
+            raise
+        browser_profiles.bind(slot, driver)
+        return driver
+
+    def acquire_driver(self):
+        """取一个截图用的浏览器：优先复用会话池中已登录的浏览器"""
+        factory = self.create_capture_driver
+        if self.pool is None:
+            return factory()
+        key = (
+            self.gui.get_browser_type(),
+            wqdlconfig.capture_headless,
+            wqdlconfig.block_resources,
+        )
+        return self.pool.acquire(key, factory)
+
+    def release_driver(self, driver, reuse: bool = True):
+        """归还浏览器到会话池；没有会话池或浏览器已不可用时直接关闭"""
+        if self.pool is not None:
+            self.pool.release(driver, reuse=reuse)
+            return
+        try:
+            driver.quit()
+        except Exception:
+            pass
 
     # Step 1-2
     @show_log
@@ -1054,6 +1273,26 @@ class WQBookDownloader:
             return True
         return False
 
+    # Step 2-2
+    @show_log
+    def prime_cookies(self, driver) -> bool:
+        """
+        在第一次打开阅读页面之前写入登录 cookies，使阅读页面只需加载一次。
+        Chrome / Edge 通过 CDP 一次性写入；Firefox 先打开同域名下的轻量页面（robots.txt）再逐个添加
+        """
+        if not os.path.exists("cookies.json"):
+            return False
+        with open("cookies.json", "r") as f:
+            cookies = json.load(f)
+        if is_chromium(driver):
+            set_cookies(driver, cookies)
+        else:
+            driver.get(f"https://{self.book['domain']}/robots.txt")
+            for cookie in cookies:
+                driver.add_cookie(cookie)
+        self.gui.print_info("Cookies 已加载")
+        return True
+
     # Step 1
     @show_log
     def login_workflow(self):
@@ -1139,6 +1378,8 @@ class WQBookDownloader:
             time.sleep(2)  # 等待页面加载完成
             self.save_cookies()
             self.driver.quit()
+            if self.pool is not None:
+                self.pool.invalidate()  # 复用的浏览器需要重新加载新的 cookies
             self.gui.close_waiting_dialog()
             self.gui.query_user(
                 "提示",
@@ -1150,141 +1391,573 @@ class WQBookDownloader:
             self.gui.query_user("提示", "登录失败", ["确认"])
             return False
 
-    # Step 2
+    # Step 2-3
     @show_log
-    def capture_pages(self) -> str:
-        self.gui.waiting_dialog("请稍候", "正在截取书籍页面，请勿关闭窗口...")
-        self.book["downloaded_pages"] = 0
-        self.setup_driver(headless=wqdlconfig.capture_headless, window_size="maximized")
-        # self.driver.get(f"https://{self.book['domain']}/deep/m/read/pdf?bid={self.book['bid']}")
+    def open_reader(self, driver, interactive=True) -> str:
+        """
+        在指定浏览器中打开阅读页面并加载登录状态，返回 "继续截取" / "返回" / "重新登录"。
+        interactive=False 时不弹出对话框（供并行截图的 worker 和重试恢复使用），
+        只在检测到阅读限制时标记 self.read_limited
+        """
+        page_url = wqdlconfig.page_url_pattern.format(
+            domain=self.book["domain"], bid=self.book["bid"]
+        )
+        if self.pool is not None and self.pool.is_primed(driver, self.book["domain"]):
+            # 会话池中的浏览器已加载过 cookies，只需跳转一次
+            driver.get(page_url)
+        else:
+            # 先写入 cookies 再打开阅读页面，阅读页面只加载一次
+            self.prime_cookies(driver)
+            driver.get(page_url)
+            if self.pool is not None:
+                self.pool.mark_primed(driver, self.book["domain"])
 
-        flag = False
+        # 等待 class=".e_tip" 元素出现并点击（点击屏幕中央出现的指导页）
+        try:
+            WebDriverWait(driver, 5).until(
+                EC.presence_of_element_located((By.CSS_SELECTOR, ".e_tip"))
+            ).click()
+        except TimeoutException:
+            # 说明没有指导页，直接跳过
+            pass
 
-        def init():
-            nonlocal flag
-            self.driver.get(
-                wqdlconfig.page_url_pattern.format(
-                    domain=self.book["domain"], bid=self.book["bid"]
-                )
-            )
-            time.sleep(1)
-            self.load_cookies()
-            # self.driver.get(f"https://{self.book['domain']}/deep/m/read/pdf?bid={self.book['bid']}")
-            self.driver.get(
-                wqdlconfig.page_url_pattern.format(
-                    domain=self.book["domain"], bid=self.book["bid"]
-                )
+        # 获取书籍信息
+        WebDriverWait(driver, 30).until(
+            EC.presence_of_element_located((By.CSS_SELECTOR, ".perc"))
+        )
+        time.sleep(2)
+        driver.find_element(By.CSS_SELECTOR, ".perc")
+        driver.find_element(By.CSS_SELECTOR, ".e_title span")
+
+        # document.body.querySelector('#readWarn')
+        if driver.find_elements(By.ID, "readWarn") != []:
+            self.read_limited = True
+            if not interactive:
+                return "继续截取"
+            res = self.gui.query_user(
+                content=f"该书籍为付费书籍，但似乎您未购买，将只能截取前 {self.book['canreadpages']} 页。\n（或者登录状态已失效）",
+                selections=["重新登录", "继续截取", "返回"],
             )
+            if res == "返回":
+                self.release_driver(driver)
+                return res
+            elif res == "重新登录":
+                self.release_driver(driver, reuse=False)
+                return res
+            else:
+                self.gui.waiting_dialog("请稍候", "正在截取书籍页面，请勿关闭窗口...")
+        elif interactive:
+            self.read_limited = False
+        return "继续截取"
+
+    def page_image_path(self, page_num: int, ext: str = "png") -> str:
+        return os.path.join(self.image_dir, f"image{page_num}.{ext}")
+
+    def find_page_image(self, page_num: int) -> Optional[str]:
+        """查找已保存的页面图片（可能是截图 png，也可能是原始的 jpg / webp）"""
+        for ext in PAGE_IMAGE_EXTENSIONS:
+            img_path = self.page_image_path(page_num, ext)
+            if os.path.exists(img_path):
+                return img_path
+        return None
+
+    def remove_page_images(self, page_num: int, keep_ext: Optional[str] = None):
+        for ext in PAGE_IMAGE_EXTENSIONS:
+            img_path = self.page_image_path(page_num, ext)
+            if ext != keep_ext and os.path.exists(img_path):
+                os.remove(img_path)
+
+    def write_page_image(self, page_num: int, data: bytes, ext: str, **fields) -> str:
+        """原子写入页面图片并记录到页面清单（在写盘线程中执行）"""
+        self.remove_page_images(page_num, keep_ext=ext)
+        params = {
+            "backend": wqdlconfig.capture_backend,
+            "format": ext,
+            "scale": wqdlconfig.force_device_scale_factor,
+            "window": list(wqdlconfig.capture_window_size),
+        }
+        # 清单每写入若干页保存一次，截图结束时再完整保存
+        written = self.stats.incr("written_pages")
+        return self.manifest.write_page(
+            page_num,
+            f"image{page_num}.{ext}",
+            data,
+            params,
+            save=written % 10 == 0,
+            **fields,
+        )
+
+    def save_page_bytes(self, page_num: int, data: bytes, ext: str, **fields):
+        """把页面图片交给写盘线程"""
+        self.writer.submit(page_num, data, ext, **fields)
+
+    def harvest_loaded_pages(
+        self, harvester: NetworkImageHarvester, scheduler: PageScheduler
+    ) -> List[int]:
+        """顺带保存本次滚动中阅读器已经加载好的其他页面，返回保存的页码"""
+        harvested = []
+        for page_num, src in sorted(harvester.page_sources().items()):
+            if self.read_limited and page_num > self.book["canreadpages"]:
+                continue
+            if page_num in scheduler.completed:
+                continue
+            res = harvester.fetch(src)
+            if res is None or not scheduler.claim(page_num):
+                continue
+            self.save_page_bytes(page_num, *res)
+            scheduler.complete(page_num)
+            harvested.append(page_num)
+        return harvested
 
-            # 等待 class=".e_tip" 元素出现并点击（点击屏幕中央出现的指导页）
+    def validate_page(self, page_num: int, data: bytes):
+        """
+        检查截图是否为空白、未渲染完成或与相邻页重复，
+        返回 (问题描述, 感知哈希)；正常时问题描述为 None
+        """
+        gray = load_gray(data)
+        problem = check_page_image(gray)
+        digest = f"{dhash(gray, PAGE_HASH_SIZE):0{PAGE_HASH_SIZE ** 2 // 4}x}"
+        self.page_hashes[page_num] = digest
+        self.page_thumbs[page_num] = gray
+        # 只保留附近页面的缩略图
+        self.page_thumbs.pop(page_num - 64, None)
+        if problem is None:
+            for neighbour in (page_num - 1, page_num + 1):
+                other = self.page_hashes.get(neighbour)
+                if other is None:
+                    other = (self.manifest.get(neighbour) or {}).get("phash")
+                # 旧版本记录的 64 位哈希无法比较
+                if other is None or len(other) != len(digest):
+                    continue
+                if hamming(int(digest, 16), int(other, 16)) > wqdlconfig.duplicate_hash_distance:
+                    continue
+                # 哈希相近的文字页很多，再比对缩略图确认
+                if self.same_page_image(gray, neighbour):
+                    problem = f"与第 {neighbour} 页重复"
+                    break
+        return problem, digest
+
+    def same_page_image(self, gray, page_num: int) -> bool:
+        """比对缩略图与已截取页面的结构相似度；没有该页的图片时按哈希结果视为相同"""
+        other = self.page_thumbs.get(page_num)
+        if other is None:
+            img_path = self.find_page_image(page_num)
+            if img_path is None:
+                return True
             try:
-                WebDriverWait(self.driver, 5).until(
-                    EC.presence_of_element_located((By.CSS_SELECTOR, ".e_tip"))
-                ).click()
-            except TimeoutException:
-                # 说明没有指导页，直接跳过
-                pass
+                other = load_gray(img_path)
+            except Exception:
+                return True
+        if other.shape != gray.shape:
+            return False
+        return ssim(gray, other) >= wqdlconfig.duplicate_ssim
 
-            # 获取书籍信息
-            WebDriverWait(self.driver, 30).until(
-                EC.presence_of_element_located((By.CSS_SELECTOR, ".perc"))
+    # Step 2-4
+    def capture_page(
+        self, driver, page_num: int, harvester: Optional[NetworkImageHarvester] = None
+    ):
+        """
+        在指定浏览器中截取一页，返回 (等待页面就绪所用的秒数, 图片字节, 扩展名)，由调用方交给写盘线程。
+        提供 harvester 时优先使用阅读器下载的原始图片，取不到时再截图
+        """
+        element_id = f"pageImgBox{page_num}"
+        waits = self.wait_controller
+        ready = {}
+        if wqdlconfig.event_ready:
+            # 在页面内等待图片解码完成，快的页面只需几毫秒；同时返回截图区域和图片地址
+            ready = wait_page_ready(driver, page_num, waits.timeout)
+            waited = ready["waited"]
+            if waits.settle > 0:
+                time.sleep(waits.settle)
+                ready.pop("rect", None)  # 等待期间布局可能变化，截图前重新获取
+        else:
+            start = time.time()
+            # driver.execute_script(f"document.getElementById('{element_id}').style.zoom='200%';")  # 放大页面
+            driver.execute_script(
+                f"document.getElementById('{element_id}')?.scrollIntoView({{behavior: 'instant', block: 'center', inline: 'nearest'}});"
             )
-            time.sleep(2)
-            self.driver.find_element(By.CSS_SELECTOR, ".perc")
-            self.driver.find_element(By.CSS_SELECTOR, ".e_title span")
+            time.sleep(waits.settle)
 
-            # document.body.querySelector('#readWarn')
-            if self.driver.find_elements(By.ID, "readWarn") != []:
-                flag = True
-                res = self.gui.query_user(
-                    content=f"该书籍为付费书籍，但似乎您未购买，将只能截取前 {self.book['canreadpages']} 页。\n（或者登录状态已失效）",
-                    selections=["重新登录", "继续截取", "返回"],
+            WebDriverWait(driver, waits.timeout).until(
+                EC.presence_of_element_located(
+                    (By.CSS_SELECTOR, f"#{element_id} uni-view.page-lmg img")
                 )
-                if res == "返回":
-                    self.driver.quit()
-                    return res
-                elif res == "重新登录":
-                    self.driver.quit()
-                    return res
+            )
+            time.sleep(waits.settle)
+            waited = time.time() - start
+        waits.observe(waited)
+
+        if harvester is not None:
+            src = ready.get("src") or harvester.page_sources().get(page_num)
+            res = harvester.fetch(src) if src else None
+            if res is not None:
+                return (waited, *res)
+
+        if wqdlconfig.cdp_screenshot and is_chromium(driver):
+            clip = ready.get("rect") or driver.execute_script(
+                ELEMENT_RECT_SCRIPT, element_id
+            )
+            if clip:
+                data = capture_screenshot(
+                    driver,
+                    clip,
+                    wqdlconfig.screenshot_format,
+                    wqdlconfig.screenshot_quality,
+                    wqdlconfig.capture_beyond_viewport,
+                )
+                ext = SCREENSHOT_FORMAT_EXTENSIONS[wqdlconfig.screenshot_format]
+                return waited, data, ext
+
+        element = driver.find_element(By.ID, element_id)
+        # 缩放页面
+        # element = driver.find_element(By.CSS_SELECTOR, f"#{element_id} uni-view.page-lmg")
+        return waited, element.screenshot_as_png, "png"
+
+    def network_snapshot(self, driver) -> Optional[dict]:
+        """读取该浏览器当前的网络统计（未开启 performance 日志时返回 None）"""
+        if not (wqdlconfig.block_resources or wqdlconfig.capture_backend == "network"):
+            return None
+        if not is_chromium(driver):
+            return None
+        return NetworkMonitor.for_driver(driver).snapshot()
+
+    def record_network_stats(self, driver, start: Optional[dict]):
+        """把本次截图期间该浏览器的请求数、被屏蔽请求数和下载字节数计入统计"""
+        end = self.network_snapshot(driver) if start is not None else None
+        if end is None:
+            return
+        for key, value in end.items():
+            self.stats.incr(key, value - start[key])
+
+    def make_harvester(self, driver) -> Optional[NetworkImageHarvester]:
+        if wqdlconfig.capture_backend == "network" and is_chromium(driver):
+            return NetworkImageHarvester(driver)
+        return None
+
+    def recover_page(self, driver, page_num: int, start_tier: int = 0):
+        """
+        分级恢复：依次尝试 重新滚动 → 跳转到页面 → 刷新页面 → 重启浏览器，
+        某一级让该页重新就绪后即停止。记录每一级的尝试次数、成功次数和耗时。
+        返回（可能已更换的）浏览器；全部失败时抛出最后一个错误
+        """
+        error = None
+        original = driver
+        for tier in RECOVERY_TIERS[min(start_tier, len(RECOVERY_TIERS) - 1):]:
+            start = time.time()
+            self.stats.incr(f"recovery_{tier}")
+            try:
+                if tier == "rescroll":
+                    driver.execute_script(RESCROLL_SCRIPT, page_num)
+                elif tier == "jump":
+                    driver.execute_script(JUMP_SCRIPT, page_num)
+                elif tier == "reload":
+                    self.open_reader(driver, interactive=False)
                 else:
-                    self.gui.waiting_dialog(
-                        "请稍候", "正在截取书籍页面，请勿关闭窗口..."
-                    )
-            else:
-                flag = False
-            return "继续截取"
+                    self.release_driver(driver, reuse=False)
+                    driver = self.acquire_driver()
+                    self.open_reader(driver, interactive=False)
+                if self.read_limited and page_num > self.book["canreadpages"]:
+                    return driver
+                wait_page_ready(
+                    driver,
+                    page_num,
+                    5 if tier in ("rescroll", "jump") else self.wait_controller.timeout,
+                )
+                self.stats.incr(f"recovery_{tier}_ok")
+                return driver
+            except (NoSuchWindowException, InvalidSessionIdException) as e:
+                if tier == "restart":
+                    raise
+                error = e
+            except Exception as e:
+                error = e
+            finally:
+                self.stats.incr(f"recovery_{tier}_seconds", time.time() - start)
+        if driver is not original:
+            self.release_driver(driver, reuse=False)
+        raise error
+
+    # Step 2-5
+    def capture_worker(
+        self,
+        worker_id: int,
+        driver,
+        scheduler: PageScheduler,
+        start_time: float,
+        network: Optional[dict] = None,
+    ):
+        """
+        并行截图的 worker：不断从调度器领取页面并截图。
+        driver 为 None 时自行启动一个无头浏览器；浏览器失效时把剩余页面交还调度器
+        """
+        page_num = None
+        healthy = True
+        try:
+            if driver is None:
+                driver = self.acquire_driver()
+                network = self.network_snapshot(driver)
+                self.open_reader(driver, interactive=False)
+            harvester = self.make_harvester(driver)
+            prefetched = set()
+            while (page_num := scheduler.next_page(worker_id)) is not None:
+                for retry in range(4):
+                    try:
+                        if self.read_limited and page_num > self.book["canreadpages"]:
+                            self.gui.print_info("已到达可阅读页数")
+                            raise Exception("已到达可阅读页数")
+                        waited, data, ext = self.capture_page(driver, page_num, harvester)
+                        fields = {}
+                        if wqdlconfig.validate_pages:
+                            previous = self.page_hashes.get(page_num)
+                            problem, fields["phash"] = self.validate_page(page_num, data)
+                            if (
+                                problem is not None
+                                and scheduler.requeued.get(page_num, 0)
+                                < wqdlconfig.validate_retries
+                            ):
+                                # 有问题的页面放回队列，稍后重新截取；
+                                # 重新截取的结果与上次相同时页面本来如此（如空白页），不是等待不足
+                                if fields["phash"] != previous:
+                                    self.wait_controller.penalize()
+                                scheduler.requeue(page_num)
+                                self.gui.print_info(
+                                    f"第 {page_num} 页截图{problem}，稍后重新截取"
+                                )
+                                break
+                        self.save_page_bytes(page_num, data, ext, **fields)
+                        scheduler.complete(page_num)
+                        self.stats.incr("ready_seconds", waited)
+                        if page_num in prefetched:
+                            prefetched.discard(page_num)
+                            self.stats.incr("prefetched")
+                            if waited < 0.05:
+                                self.stats.incr("prefetch_hits")
+                        if harvester is not None:
+                            self.harvest_loaded_pages(harvester, scheduler)
+                        if wqdlconfig.prefetch_window > 0:
+                            # 截图完成后让阅读器提前加载接下来的几页
+                            upcoming = scheduler.peek(worker_id, wqdlconfig.prefetch_window)
+                            prefetch_pages(driver, upcoming)
+                            prefetched.update(upcoming)
+                        done = len(scheduler.completed)
+                        self.gui.print_info(
+                            f"第 {page_num} 页截图保存成功（等待 {waited*1000:.0f} ms），预计剩余时间：{(time.time()-start_time)/(done+1)*(scheduler.total-done):.2f} 秒"
+                        )
+                        break
+                    except (NoSuchWindowException, InvalidSessionIdException):
+                        raise
+                    except Exception as e:
+                        self.wait_controller.penalize(
+                            timed_out=isinstance(e, (TimeoutError, TimeoutException))
+                        )
+                        if (
+                            page_num == self.book["canreadpages"] + 1
+                            or self.read_limited
+                            or page_num == 1
+                            or retry >= 3
+                        ):
+                            self.gui.print_info(f"第 {page_num} 页截取失败，错误：{e}")
+                            scheduler.fail(page_num, e)
+                            break
+                        self.gui.print_info(
+                            f"第 {page_num} 页截取失败，重试中... ({retry+1}/4)"
+                        )
+                        # 从最便宜的恢复手段开始；同一页反复失败时跳过已经无效的手段
+                        recovered = self.recover_page(driver, page_num, start_tier=retry)
+                        if recovered is not driver:
+                            driver = recovered
+                            harvester = self.make_harvester(driver)
+                            network = self.network_snapshot(driver)
+            self.record_network_stats(driver, network)
+        except Exception as e:
+            healthy = False
+            count = scheduler.retire(worker_id, e, page_num)
+            self.gui.print_info(
+                f"浏览器 {worker_id + 1} 已失效，{count} 页已交给其他浏览器：{e}"
+            )
+        finally:
+            if driver is not None:
+                self.release_driver(driver, reuse=healthy)
+
+    def report_capture_stats(self):
+        """输出截图耗时统计（状态栏只显示第一行，完整信息打印到控制台）"""
+        lines = []
+        p50 = self.wait_controller.percentile(50)
+        if p50 is not None:
+            lines.append(
+                f"页面就绪耗时 P50 {p50*1000:.0f} ms / P95 {self.wait_controller.percentile()*1000:.0f} ms，"
+                f"额外等待 {self.wait_controller.settle*1000:.0f} ms"
+            )
+        if wqdlconfig.prefetch_window > 0:
+            lines.append(
+                f"预加载窗口 {wqdlconfig.prefetch_window} 页，"
+                f"命中 {self.stats.get('prefetch_hits'):.0f}/{self.stats.get('prefetched'):.0f} 页"
+            )
+        if self.stats.get("requests"):
+            lines.append(
+                f"网络：{self.stats.get('requests'):.0f} 个请求，屏蔽 {self.stats.get('blocked'):.0f} 个，"
+                f"下载 {self.stats.get('downloaded_bytes') / 1024 / 1024:.1f} MB"
+            )
+        if self.stats.get("written_pages"):
+            lines.append(
+                f"写盘：{self.stats.get('written_pages'):.0f} 页 {self.stats.get('written_bytes') / 1024 / 1024:.1f} MB，"
+                f"队列最大深度 {self.stats.get('writer_queue_max'):.0f}/{wqdlconfig.writer_queue_depth}，"
+                f"截图线程因背压等待 {self.stats.get('writer_blocked_seconds'):.1f} 秒"
+            )
+        recoveries = [
+            f"{RECOVERY_TIER_NAMES[tier]} {self.stats.get(f'recovery_{tier}_ok'):.0f}/{self.stats.get(f'recovery_{tier}'):.0f} 次成功"
+            f"（{self.stats.get(f'recovery_{tier}_seconds'):.1f} 秒）"
+            for tier in RECOVERY_TIERS
+            if self.stats.get(f"recovery_{tier}")
+        ]
+        if recoveries:
+            lines.append("恢复：" + "，".join(recoveries))
+        if lines:
+            print("\n".join(lines))
+            self.gui.print_info(lines[0])
 
-        res = init()
+    # Step 2
+    @show_log
+    def capture_pages(self) -> str:
+        self.gui.waiting_dialog("请稍候", "正在截取书籍页面，请勿关闭窗口...")
+        self.book["downloaded_pages"] = 0
+        self.read_limited = False
+        self.driver = self.acquire_driver()
+        network = self.network_snapshot(self.driver)
+
+        res = self.open_reader(self.driver)
         if res == "返回" or res == "重新登录":
             return res
 
-        # 截图每一页
-        start_time = time.time()
+        # 清理上次崩溃时留下的临时文件
+        for file_name in os.listdir(self.image_dir):
+            if file_name.endswith(".tmp"):
+                os.remove(os.path.join(self.image_dir, file_name))
+
+        # 只跳过校验通过的页面，不完整的图片重新截取
+        pages = []
         for page_num in range(1, self.book["pages"] + 1):
-            img_path = os.path.join(self.image_dir, f"image{page_num}.png")
-            if os.path.exists(img_path):
+            img_path = self.find_page_image(page_num)
+            if self.manifest.verify(page_num, img_path):
                 self.gui.print_info(f"第 {page_num} 页已存在，跳过")
                 continue
-            for retry in range(4):
-                try:
-                    if flag and page_num > self.book["canreadpages"]:
-                        self.gui.print_info("已到达可阅读页数")
-                        raise Exception("已到达可阅读页数")
-
-                    element_id = f"pageImgBox{page_num}"
-                    # self.driver.execute_script(f"document.getElementById('{element_id}').style.zoom='200%';")  # 放大页面
-                    self.driver.execute_script(
-                        f"document.getElementById('{element_id}')?.scrollIntoView({{behavior: 'instant', block: 'center', inline: 'nearest'}});"
-                    )
-                    time.sleep(SCREENSHOT_WAIT)
-
-                    WebDriverWait(self.driver, 20).until(
-                        EC.presence_of_element_located(
-                            (By.CSS_SELECTOR, f"#{element_id} uni-view.page-lmg img")
-                        )
-                    )
-                    time.sleep(SCREENSHOT_WAIT)
-
-                    element = self.driver.find_element(By.ID, element_id)
-                    # self.driver.execute_script(f"document.getElementById('{element_id}').style.zoom='200%';")  # 放大页面
-                    # print(element.size)
-
-                    # 缩放页面
-                    # element = self.driver.find_element(By.CSS_SELECTOR, f"#{element_id} uni-view.page-lmg")
-                    element.screenshot(img_path)
-                    self.gui.print_info(
-                        f"第 {page_num} 页截图保存成功，预计剩余时间：{(time.time()-start_time)/(page_num+1)*(self.book['pages']-page_num):.2f} 秒"
-                    )
-                    break
-                except Exception as e:
-                    if page_num == self.book["canreadpages"] + 1 or flag:
-                        res = self.gui.query_user(
-                            content=f"已到达可阅读页数 {self.book['canreadpages']}。\n可能您未购买该电子书，或者登录状态已失效。\n如果您已购买，请尝试重新登录。",
-                            selections=["重新登录", "继续生成PDF"],
-                        )
-                        if res == "重新登录":
-                            self.driver.quit()
-                            return res
-                        self.gui.waiting_dialog(
-                            "请稍候", "正在释放资源，请勿关闭窗口..."
-                        )
-                        self.book["downloaded_pages"] = page_num - 1
-                        self.driver.quit()
-                        return res
-                    elif page_num != 1 and retry < 3:
-                        self.gui.print_info(
-                            f"第 {page_num} 页截取失败，重试中... ({retry+1}/4)"
-                        )
-                        time.sleep(0.5)
-                        res = init()
-                        if res == "返回" or res == "重新登录":
-                            return res
-                    else:
-                        self.gui.print_info(f"第 {page_num} 页截取失败，错误：{e}")
-                        raise e
+            if img_path is not None:
+                self.gui.print_info(f"第 {page_num} 页图片不完整，将重新截取")
+                self.remove_page_images(page_num)
+                self.manifest.invalidate(page_num, save=False)
+            pages.append(page_num)
+        self.manifest.save()
+
+        self.stats = CaptureStats()
+        self.page_hashes = {}
+        self.page_thumbs = {}
+        self.writer = ImageWriter(
+            self.write_page_image,
+            threads=wqdlconfig.writer_threads,
+            depth=wqdlconfig.writer_queue_depth,
+            stats=self.stats,
+        )
+        # 已有可以增量更新的 PDF、或使用目标大小模式（需要所有页面到齐后分配质量）时不在后台生成
+        if (
+            wqdlconfig.stream_pdf
+            and not (wqdlconfig.pdf_target_mb or wqdlconfig.pdf_target_kb_per_page)
+            and not self.patchable_pdf(self.default_pdf_path())
+        ):
+            if self.pdf_stream is None:
+                self.pdf_stream = StreamingPdfBuilder(
+                    self.new_pdf_builder(),
+                    self.find_page_image,
+                    sample_pages=[
+                        i + 1
+                        for i in sample_indices(self.book["pages"], wqdlconfig.crop_sample_pages)
+                    ],
+                    on_error=lambda e: self.gui.print_info(
+                        f"后台生成 PDF 出错，剩余页面将在截图结束后生成：{e}"
+                    ),
+                )
+            # 已存在的页面可以直接编码，新截取的页面写盘后再通知
+            missing = set(pages)
+            for page_num in range(1, self.book["pages"] + 1):
+                if page_num not in missing:
+                    self.pdf_stream.page_ready(page_num)
+            self.writer.on_written.append(self.pdf_stream.page_ready)
+        # 等待参数：从该域名上次学到的值开始
+        self.wait_controller = AdaptiveWait.from_profile(
+            wqdlconfig.wait_profiles.get(self.book["domain"])
+            if wqdlconfig.adaptive_wait
+            else None,
+            settle=0.0 if wqdlconfig.event_ready else SCREENSHOT_WAIT,
+            timeout=wqdlconfig.page_ready_timeout,
+            min_timeout=5 if wqdlconfig.adaptive_wait else wqdlconfig.page_ready_timeout,
+            max_timeout=(
+                max(60, wqdlconfig.page_ready_timeout)
+                if wqdlconfig.adaptive_wait
+                else wqdlconfig.page_ready_timeout
+            ),
+            min_settle=0.0 if wqdlconfig.adaptive_wait else SCREENSHOT_WAIT,
+            max_settle=3.0 if wqdlconfig.adaptive_wait else SCREENSHOT_WAIT,
+        )
+
+        # 截图每一页：主浏览器作为 worker 0，其余 worker 各自启动无头浏览器。
+        # 后台生成 PDF 需要裁剪框时先截取抽样页，使后台生成不必等到整本书快截完才开始
+        scheduler = PageScheduler(
+            pages,
+            wqdlconfig.capture_workers,
+            wqdlconfig.capture_shard_mode,
+            priority=self.pdf_stream.sample_pages if self.pdf_stream is not None else (),
+        )
+        start_time = time.time()
+        workers = [
+            threading.Thread(
+                target=self.capture_worker,
+                args=(
+                    i,
+                    self.driver if i == 0 else None,
+                    scheduler,
+                    start_time,
+                    network if i == 0 else None,
+                ),
+                daemon=True,
+            )
+            for i in range(scheduler.workers)
+        ]
+        for worker in workers:
+            worker.start()
+        try:
+            for worker in workers:
+                worker.join()
+        finally:
+            self.writer.close()
+            self.manifest.save()
+
+        if wqdlconfig.adaptive_wait:
+            profiles = dict(wqdlconfig.wait_profiles)
+            profiles[self.book["domain"]] = self.wait_controller.to_profile()
+            wqdlconfig.wait_profiles = profiles
+        self.report_capture_stats()
+
+        if scheduler.pending():
+            # 所有浏览器都已失效，仍有页面未截取
+            raise next(iter(scheduler.worker_errors.values()))
+        if self.writer.errors:
+            # 写盘失败（例如磁盘已满）
+            raise self.writer.errors[min(self.writer.errors)]
+
+        failure = scheduler.first_failure()
+        if failure is not None:
+            page_num, e = failure
+            if page_num == self.book["canreadpages"] + 1 or self.read_limited:
+                res = self.gui.query_user(
+                    content=f"已到达可阅读页数 {self.book['canreadpages']}。\n可能您未购买该电子书，或者登录状态已失效。\n如果您已购买，请尝试重新登录。",
+                    selections=["重新登录", "继续生成PDF"],
+                )
+                if res == "重新登录":
+                    return res
+                self.book["downloaded_pages"] = page_num - 1
+                return res
+            raise e
 
         self.book["downloaded_pages"] = self.book["pages"]
-        self.driver.quit()
         self.gui.close_waiting_dialog()
         self.gui.print_info(f"{self.book['name']} 所有页面截取已完成")
 
@@ -1310,22 +1983,165 @@ class WQBookDownloader:
     #     self.gui.close_waiting_dialog()
     #     return output_path
 
-    @show_log
-    def create_pdf(self):
-        self.gui.waiting_dialog("请稍候", "正在生成 PDF，请勿关闭窗口...")
-        output_path = os.path.join(
+    def pdf_options(self) -> dict:
+        options = dict(
+            quality=wqdlconfig.pdf_quality,
+            workers=wqdlconfig.pdf_workers or os.cpu_count() or 1,
+            encoding=wqdlconfig.pdf_encoding,
+            midtone_ratio=wqdlconfig.bilevel_midtone_ratio,
+            auto_crop=wqdlconfig.pdf_auto_crop,
+            crop_tolerance=wqdlconfig.crop_tolerance,
+            crop_margin=wqdlconfig.crop_margin,
+            crop_samples=wqdlconfig.crop_sample_pages,
+            target_bytes=self.pdf_target_bytes(),
+            min_ssim=wqdlconfig.pdf_min_ssim,
+        )
+        # 上次为这本书计算的裁剪框（截图窗口大小不变时沿用，保证前后生成的 PDF 页面一致）
+        crop = self.manifest.meta.get("crop")
+        if crop is not None and crop["window"] == list(wqdlconfig.capture_window_size):
+            options["crop_box"] = tuple(crop["box"]) if crop["box"] else None
+        return options
+
+    def pdf_target_bytes(self) -> int:
+        if wqdlconfig.pdf_target_mb > 0:
+            return int(wqdlconfig.pdf_target_mb * 1024 * 1024)
+        return int(
+            wqdlconfig.pdf_target_kb_per_page * 1024 * self.book.get("downloaded_pages", 0)
+        )
+
+    def setup_pdf_builder(self, builder: PdfBuilder, options: dict) -> PdfBuilder:
+        if "crop_box" in options:
+            builder.crop_prepared = True
+        return builder
+
+    def new_pdf_builder(self) -> PdfBuilder:
+        options = self.pdf_options()
+        if wqdlconfig.pdf_chunk_pages <= 0:
+            return self.setup_pdf_builder(PdfBuilder(**options), options)
+        builder = ChunkedPdfBuilder(
+            os.path.join(self.book_dir, "build.pdf"),
+            wqdlconfig.pdf_chunk_pages,
+            page_key=self.page_hash,
+            **options,
+        )
+        if builder.resumed:
+            self.gui.print_info(f"继续上次未完成的 PDF，已生成 {builder.resumed} 页")
+        return self.setup_pdf_builder(builder, options)
+
+    def page_hash(self, page_num: int) -> Optional[str]:
+        return (self.manifest.get(page_num) or {}).get("hash")
+
+    def default_pdf_path(self) -> str:
+        return os.path.join(
             # self.book_dir, f"{self.book['bid']}_{self.book['name']}.pdf"
             self.download_dir,
             f"{self.book['name']}.pdf",
         )
+
+    def record_pdf(self, output_path: str, builder: PdfBuilder, pages: int):
+        """在清单中记录生成的 PDF 及其每页对应的图片哈希，之后可以只更新变化的页面"""
+        self.manifest.meta["pdf"] = {
+            "path": os.path.abspath(output_path),
+            "size": os.path.getsize(output_path),
+            "mtime": os.path.getmtime(output_path),
+            "params": builder.params(),
+            "crop_box": builder.crop_box,
+            "pages": [self.page_hash(page_num) for page_num in range(1, pages + 1)],
+            "image_xrefs": builder.image_xrefs,
+        }
+        if builder.auto_crop:
+            self.manifest.meta["crop"] = {
+                "box": builder.crop_box,
+                "window": list(wqdlconfig.capture_window_size),
+            }
+        self.manifest.save()
+
+    def patchable_pdf(self, output_path: str) -> Optional[dict]:
+        """output_path 是本程序上次为这本书生成、之后未被修改、且编码参数相同的 PDF 时，返回其记录"""
+        record = self.manifest.meta.get("pdf")
+        if (
+            record is None
+            or self.pdf_target_bytes()  # 目标大小模式需要按整本书分配质量，重新生成
+            or record["path"] != os.path.abspath(output_path)
+            or not os.path.exists(output_path)
+            or os.path.getsize(output_path) != record["size"]
+            or os.path.getmtime(output_path) != record["mtime"]
+        ):
+            return None
+        options = self.pdf_options()
+        if {name: options[name] for name in ENCODE_PARAMS} != record["params"] or (
+            options.get("crop_box") != (tuple(record["crop_box"]) if record["crop_box"] else None)
+            and record["params"]["auto_crop"]
+        ):
+            return None
+        return record
+
+    def patch_pdf(self, output_path: str, record: dict, toc) -> Optional[str]:
+        """只替换图片发生变化的页面、追加新页面，以增量保存的方式更新已有的 PDF"""
+        downloaded = self.book["downloaded_pages"]
+        old_hashes = record["pages"]
+        changed = {
+            page_num: self.find_page_image(page_num)
+            for page_num in range(1, min(downloaded, len(old_hashes)) + 1)
+            if self.page_hash(page_num) != old_hashes[page_num - 1]
+        }
+        options = self.pdf_options()
+        patcher = self.setup_pdf_builder(
+            PdfPatcher(output_path, record["image_xrefs"], **options), options
+        )
+        try:
+            if not patcher.can_patch():
+                return None
+            patcher.truncate(downloaded)
+            appended = downloaded - patcher.pages
+            patcher.replace_images(changed)
+            patcher.add_image_files(
+                self.find_page_image(page_num)
+                for page_num in range(patcher.pages + 1, downloaded + 1)
+            )
+            patcher.save(output_path, toc)
+        finally:
+            patcher.close()
+        self.record_pdf(output_path, patcher, downloaded)
+        self.gui.print_info(
+            f"已更新 PDF：替换 {patcher.replaced} 页，追加 {max(0, appended)} 页"
+        )
+        return output_path
+
+    @show_log
+    def create_pdf(self, toc_data=None):
+        self.gui.waiting_dialog("请稍候", "正在生成 PDF，请勿关闭窗口...")
+        output_path = self.default_pdf_path()
+        toc = None
+        if toc_data is not None:
+            try:
+                toc = flatten_toc(toc_data)
+            except Exception as e:
+                self.gui.print_info(f"目录数据有误，生成的 PDF 将不含目录：{e}")
         if os.path.exists(output_path):
+            # 上次生成的 PDF 可以只更新新截取、重新截取的页面
+            record = self.patchable_pdf(output_path)
             res = self.gui.query_user(
                 "提示",
-                f"PDF文件已存在，是否覆盖？\n{output_path}",
-                ["取消", "覆盖", "并存"],
+                f"PDF文件已存在，是否覆盖？\n{output_path}"
+                + ("\n选择“更新”只替换有变化的页面、追加新页面" if record else ""),
+                ["取消", "更新", "覆盖", "并存"] if record else ["取消", "覆盖", "并存"],
             )
             if res == "取消":
                 return res
+            elif res == "更新":
+                self.gui.waiting_dialog("请稍候", "正在更新 PDF，请勿关闭窗口...")
+                if self.pdf_stream is not None:
+                    self.pdf_stream.close()
+                    self.pdf_stream.builder.close()
+                    self.pdf_stream = None
+                patched = self.patch_pdf(output_path, record, toc)
+                if patched is not None:
+                    self.book["pdf_path"] = patched
+                    self.gui.close_waiting_dialog()
+                    return patched
+                self.gui.print_info("PDF 无法增量更新，将重新生成")
+                os.remove(output_path)
             elif res == "覆盖":
                 os.remove(output_path)
             else:
@@ -1335,38 +2151,51 @@ class WQBookDownloader:
                 )
             self.gui.waiting_dialog("请稍候", "正在生成 PDF，请勿关闭窗口...")
 
-        doc = fitz.open()
-        for page_num in range(1, self.book["downloaded_pages"] + 1):
-            img_path = os.path.join(self.image_dir, f"image{page_num}.png")
-            with Image.open(img_path) as img:
-                # 处理含有透明通道的PNG（转换为白色背景）
-                if img.mode in ("RGBA", "LA"):
-                    background = Image.new("RGB", img.size, (255, 255, 255))
-                    background.paste(img, mask=img.split()[-1])
-                    img = background
-                elif img.mode != "RGB":
-                    img = img.convert("RGB")
-
-                # 将图片转换为JPEG格式并压缩（质量设为85%）
-                img_byte_arr = io.BytesIO()
-                img.save(img_byte_arr, format="JPEG", quality=wqdlconfig.pdf_quality)
-                img_byte_arr.seek(0)
-
-                # 创建PDF页面并插入压缩后的图片
-                pdf_page = doc.new_page(width=img.width, height=img.height)
-                pdf_page.insert_image(
-                    rect=(0, 0, img.width, img.height),
-                    stream=img_byte_arr,  # 使用内存中的JPEG流
+        # 截图时已在后台生成的页面直接沿用，只追加剩余的页面
+        if self.pdf_stream is not None:
+            self.pdf_stream.close()
+            builder = self.pdf_stream.builder
+            if self.pdf_stream.error is not None:
+                logging.warning(f"后台生成 PDF 出错：{self.pdf_stream.error!r}")
+                self.gui.print_info(
+                    f"截图期间后台生成 PDF 出错（{self.pdf_stream.error}），从第 {builder.pages + 1} 页起重新生成"
                 )
-                time.sleep(0.001)
-
-        # 保存PDF时启用压缩和优化选项
-        doc.save(
-            output_path,
-            garbage=3,  # 删除未使用的对象
-            deflate=True,  # 启用压缩
-            clean=True,  # 优化文件结构
-        )
+            self.pdf_stream = None
+        else:
+            builder = self.new_pdf_builder()
+        try:
+            builder.truncate(self.book["downloaded_pages"])
+            if builder.pages:
+                self.gui.print_info(f"截图期间已生成 {builder.pages} 页 PDF")
+            builder.prepare_crop(
+                [
+                    self.find_page_image(page_num)
+                    for page_num in range(1, self.book["downloaded_pages"] + 1)
+                ]
+            )
+            remaining = [
+                self.find_page_image(page_num)
+                for page_num in range(builder.pages + 1, self.book["downloaded_pages"] + 1)
+            ]
+            if builder.target_bytes:
+                self.gui.print_info(
+                    f"正在分析页面，按目标大小 {builder.target_bytes / 1024 / 1024:.1f} MB 分配每页质量..."
+                )
+                builder.plan_target_size(remaining)
+            builder.add_image_files(remaining)
+            summary = builder.summary()
+            builder.save(output_path, toc)
+        finally:
+            builder.close()
+        self.record_pdf(output_path, builder, self.book["downloaded_pages"])
+        if summary:
+            self.gui.print_info(summary)
+        if builder.target_bytes:
+            size = os.path.getsize(output_path)
+            self.gui.print_info(
+                f"PDF 大小 {size / 1024 / 1024:.1f} MB，目标 {builder.target_bytes / 1024 / 1024:.1f} MB"
+                f"（偏差 {size / builder.target_bytes - 1:+.1%}）"
+            )
         self.gui.print_info(f"PDF已生成：{output_path}")
         self.book["pdf_path"] = output_path
         self.gui.close_waiting_dialog()
@@ -1375,34 +2204,27 @@ class WQBookDownloader:
     # Step 4
     @show_log
     def add_toc(self, pdf_path, toc_data, output_path: Optional[str] = None):
+        """为已生成的 PDF 添加目录；写回原文件时使用增量保存，只追加改动的对象"""
         self.gui.print_info("正在添加目录到 PDF...")
         self.gui.waiting_dialog("请稍候", "正在添加目录到 PDF，请勿关闭窗口...")
 
-        # if output_path is None:
-        #     output_path = pdf_path
-
-        def flatten_toc(data):
-            flat_toc = []
-            for item in data:
-                flat_toc.append([int(item["level"]), item["label"], int(item["pnum"])])
-                if not item["isLeaf"] and item["children"]:
-                    flat_toc.extend(flatten_toc(item["children"]))
-            return flat_toc
-
         if toc_data is None:
             return
         try:
             doc = fitz.open(pdf_path)
-            toc = flatten_toc(toc_data)
-            doc.set_toc(toc)
+            doc.set_toc(flatten_toc(toc_data))
             if output_path is None or os.path.abspath(output_path) == os.path.abspath(
                 pdf_path
             ):
-                output_path = pdf_path + ".temp.pdf"
-                doc.save(output_path)
-                doc.close()
-                os.remove(pdf_path)
-                os.rename(output_path, pdf_path)
+                output_path = pdf_path
+                if doc.can_save_incrementally():
+                    doc.saveIncr()
+                    doc.close()
+                else:
+                    temp_path = pdf_path + ".temp.pdf"
+                    doc.save(temp_path)
+                    doc.close()
+                    os.replace(temp_path, pdf_path)
             else:
                 doc.save(output_path)
                 doc.close()
@@ -1414,44 +2236,61 @@ class WQBookDownloader:
             return
 
     # Step 4-2
-    @show_log
-    def fetch_toc(self):
+    def fetch_catalog(self):
+        """
+        下载目录数据（已下载过时读取本地文件），失败时返回 None。
+        不与用户交互，在截图的同时于后台线程中调用
+        """
         # https://wqbook.wqxuetang.com/deep/book/v1/catatree?bid=3248109&volume_no=1
         # catalog_url = f"https://{self.book['domain']}/deep/book/v1/catatree?bid={self.book['bid']}{'&volume_no='+str(self.book['volume_no']) if self.book['volume_no'] else ''}"
-        catalog_url = wqdlconfig.catalog_url_pattern.format(
-            domain=self.book["domain"],
-            bid=self.book["bid"],
-            volume_info=(
-                f"&volume_no={self.book['volume_no']}" if self.book["volume_no"] else ""
-            ),
-        )
+        catalog_url = self.catalog_url()
         catalog_path = os.path.join(self.book_dir, "catalog.json")
-        catalog_data = None
         if os.path.exists(catalog_path):
             self.gui.print_info(
                 f"{'第'+str(self.book['volume_no'])+'卷的' if self.book['volume_no'] else ''}目录文件已存在，跳过下载目录文件步骤"
             )
             with open(catalog_path, "r", encoding="utf-8") as f:
-                catalog_data = json.load(f)
-        else:
+                return json.load(f)
+        self.gui.print_info(
+            f"下载{'第'+str(self.book['volume_no'])+'卷的' if self.book['volume_no'] else ''}目录文件..."
+        )
+        try:
+            catalog_data = fetch(catalog_url).json().get("data", None)
+        except Exception as e:
+            logging.warning(f"下载目录文件失败：{e}")
+            return None
+        if catalog_data is not None:
+            with open(catalog_path, "w", encoding="utf-8") as f:
+                json.dump(catalog_data, f, indent=2)
             self.gui.print_info(
-                f"下载{'第'+str(self.book['volume_no'])+'卷的' if self.book['volume_no'] else ''}目录文件..."
+                f"{'第'+str(self.book['volume_no'])+'卷的' if self.book['volume_no'] else ''}目录数据已保存到: {catalog_path}"
             )
-            catalog_data = fetch(catalog_url).json().get("data", None)
-            if catalog_data is not None:
-                with open(catalog_path, "w", encoding="utf-8") as f:
-                    json.dump(catalog_data, f, indent=2)
-                self.gui.print_info(
-                    f"{'第'+str(self.book['volume_no'])+'卷的' if self.book['volume_no'] else ''}目录数据已保存到: {catalog_path}"
-                )
-            else:
-                res = self.gui.query_user(
-                    f"下载{'第'+str(self.book['volume_no'])+'卷的' if self.book['volume_no'] else ''}目录文件失败，将无法生成目录",
-                    ["确认并报告错误", "确认"],
-                )
-                if res == "确认并报告错误":
-                    commit_issue(f"下载目录文件失败：{catalog_url}，{self.book}")
-                return None
+        return catalog_data
+
+    def catalog_url(self) -> str:
+        return wqdlconfig.catalog_url_pattern.format(
+            domain=self.book["domain"],
+            bid=self.book["bid"],
+            volume_info=(
+                f"&volume_no={self.book['volume_no']}" if self.book["volume_no"] else ""
+            ),
+        )
+
+    @show_log
+    def fetch_toc(self):
+        # 优先使用截图时在后台下载好的目录数据
+        if self.catalog_future is not None:
+            catalog_data = self.catalog_future.result()
+        else:
+            catalog_data = self.fetch_catalog()
+        if catalog_data is None:
+            res = self.gui.query_user(
+                f"下载{'第'+str(self.book['volume_no'])+'卷的' if self.book['volume_no'] else ''}目录文件失败，将无法生成目录",
+                ["确认并报告错误", "确认"],
+            )
+            if res == "确认并报告错误":
+                commit_issue(f"下载目录文件失败：{self.catalog_url()}，{self.book}")
+            return None
 
         self.book["toc_data"] = catalog_data
         return catalog_data
@@ -1470,6 +2309,19 @@ class WQBookDownloader:
                 return
             time.sleep(0.1)
 
+        try:
+            self.download()
+        finally:
+            if self.pdf_stream is not None:
+                self.pdf_stream.close()
+                self.pdf_stream.builder.close()
+                self.pdf_stream = None
+
+    def download(self):
+        # 目录数据与截图并行下载，生成 PDF 时一次性写入
+        executor = ThreadPoolExecutor(max_workers=1)
+        self.catalog_future = executor.submit(self.fetch_catalog)
+        executor.shutdown(wait=False)
         res = self.capture_pages()
 
         while res == "重新登录":
@@ -1493,15 +2345,13 @@ class WQBookDownloader:
         ):
             return
 
-        # 生成PDF
-        pdf_path = self.create_pdf()
-        if pdf_path in ["取消", "返回"]:
-            return
-
+        # 生成PDF（页面完整时连同目录一起写入，只保存一次）
+        toc_data = None
         if self.book["downloaded_pages"] == self.book["pages"]:
             toc_data = self.fetch_toc()
-            if toc_data is not None:
-                self.add_toc(pdf_path, toc_data)
+        pdf_path = self.create_pdf(toc_data)
+        if pdf_path in ["取消", "返回"]:
+            return
 
         # 清理临时文件
         if wqdlconfig.clean_up and os.path.exists(self.image_dir):
@@ -1515,15 +2365,19 @@ class WQBookDownloader:
 
 
 @show_log
-def download_book(gui_handler: WQBookDownloaderGUI, book: dict):
+def download_book(
+    gui_handler: WQBookDownloaderGUI, book: dict, pool: Optional[DriverPool] = None
+):
     # 1. 创建下载器
     downloader = WQBookDownloader(
-        book, gui_handler=gui_handler, download_dir=DOWNLOAD_DIR
+        book, gui_handler=gui_handler, download_dir=DOWNLOAD_DIR, pool=pool
     )
     downloader.run()
 
 
 if __name__ == "__main__":
+    # PDF 编码使用进程池，打包后的程序需要此调用
+    multiprocessing.freeze_support()
     if getattr(sys, "frozen", False):
         base_dir = sys._MEIPASS
     else:
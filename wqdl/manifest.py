@@ -0,0 +1,150 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from typing import Optional, Dict, Any
+
+from wqdl.utils import atomic_write, atomic_write_json
+
+MANIFEST_VERSION = 1
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def file_hash(path: str) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def has_complete_trailer(path: str) -> bool:
+    """
+    不解码图片，只检查文件结尾是否完整（PNG 的 IEND 块、JPEG 的 EOI 标记、WebP 的 RIFF 长度），
+    用于识别崩溃时被截断的旧图片
+    """
+    try:
+        size = os.path.getsize(path)
+        with open(path, "rb") as f:
+            head = f.read(12)
+            f.seek(max(0, size - 12))
+            tail = f.read()
+    except OSError:
+        return False
+    if head.startswith(b"\x89PNG"):
+        return tail.endswith(b"IEND\xaeB`\x82")
+    if head.startswith(b"\xff\xd8"):
+        return tail.rstrip(b"\x00").endswith(b"\xff\xd9")
+    if head.startswith(b"RIFF") and head[8:12] == b"WEBP":
+        return int.from_bytes(head[4:8], "little") + 8 == size
+    return False
+
+
+class PageManifest:
+    """
+    每本书的页面清单（manifest.json，与 catalog.json 同目录），记录每页的
+    状态、文件名、大小、哈希、截图参数和时间。清单和图片都采用“先写临时文件再重命名”的方式原子写入，
+    断点续传时只跳过校验通过的页面，无需解码图片。
+    """
+
+    def __init__(self, path: str, image_dir: str, verify_hash: bool = True):
+        self.path = path
+        self.image_dir = image_dir
+        self.verify_hash = verify_hash
+        self._lock = threading.Lock()
+        self.pages: Dict[str, Dict[str, Any]] = {}
+        self.meta: Dict[str, Any] = {}  # 整本书的信息，如 PDF 的裁剪框
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == MANIFEST_VERSION:
+                self.pages = data.get("pages", {})
+                self.meta = data.get("meta", {})
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.pages = {}
+            self.meta = {}
+
+    def save(self):
+        with self._lock:
+            data = {
+                "version": MANIFEST_VERSION,
+                "meta": dict(self.meta),
+                "pages": dict(self.pages),
+            }
+        atomic_write_json(self.path, data)
+
+    def get(self, page_num: int) -> Optional[Dict[str, Any]]:
+        return self.pages.get(str(page_num))
+
+    def write_page(
+        self,
+        page_num: int,
+        file_name: str,
+        data: bytes,
+        params: Optional[Dict[str, Any]] = None,
+        save: bool = True,
+        **fields,
+    ) -> str:
+        """原子写入页面图片并记录到清单（fields 为附加信息，如感知哈希），返回图片路径"""
+        img_path = os.path.join(self.image_dir, file_name)
+        atomic_write(img_path, data)
+        self.record(page_num, file_name, len(data), content_hash(data), params, save, **fields)
+        return img_path
+
+    def record(
+        self,
+        page_num: int,
+        file_name: str,
+        size: int,
+        digest: str,
+        params: Optional[Dict[str, Any]] = None,
+        save: bool = True,
+        **fields,
+    ):
+        with self._lock:
+            self.pages[str(page_num)] = {
+                "status": "done",
+                "file": file_name,
+                "size": size,
+                "hash": digest,
+                "params": params or {},
+                "time": time.time(),
+                **fields,
+            }
+        if save:
+            self.save()
+
+    def invalidate(self, page_num: int, save: bool = True):
+        with self._lock:
+            self.pages.pop(str(page_num), None)
+        if save:
+            self.save()
+
+    def verify(self, page_num: int, img_path: Optional[str]) -> bool:
+        """
+        校验页面图片：文件存在、大小一致（verify_hash 时再比对哈希）。
+        清单中没有记录的旧图片（旧版本下载的）若文件结尾完整，则补录到清单
+        """
+        if img_path is None or not os.path.exists(img_path):
+            return False
+        entry = self.get(page_num)
+        file_name = os.path.basename(img_path)
+        if entry is None:
+            if not has_complete_trailer(img_path):
+                return False
+            self.record(page_num, file_name, os.path.getsize(img_path), file_hash(img_path), {"legacy": True}, save=False)
+            return True
+        if entry.get("status") != "done" or entry.get("file") != file_name:
+            return False
+        if os.path.getsize(img_path) != entry.get("size"):
+            return False
+        if self.verify_hash and file_hash(img_path) != entry.get("hash"):
+            return False
+        return True
@@ -0,0 +1,811 @@
+import io
+import os
+import json
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+import fitz
+import numpy as np
+from PIL import Image, features
+
+from wqdl.manifest import content_hash, file_hash
+from wqdl.utils import atomic_write_json
+from wqdl.imaging import (
+    Box,
+    classify_page,
+    crop_to_box,
+    otsu_threshold,
+    sample_crop_box,
+    ssim,
+)
+
+
+PAGE_KIND_NAMES = {"color": "彩色", "gray": "灰度", "bilevel": "黑白"}
+# 影响编码结果的参数
+ENCODE_PARAMS = ("quality", "encoding", "midtone_ratio", "auto_crop", "target_bytes", "min_ssim")
+PAGE_OVERHEAD = 400  # 每页除图片外的页面对象、内容流等的大致字节数
+REPLAN_EVERY = 8  # 目标大小模式下每追加若干页，按实际大小重新分配剩余页面的质量
+BASELINE_SAMPLE_EVERY = 16  # 每隔若干页额外按彩色 JPEG 编码一次，用于估算节省的空间
+# libjpeg 标准亮度量化表（质量 50），用于估算 JPEG 的编码质量
+STD_LUMINANCE_TABLE = (
+    16, 11, 10, 16, 24, 40, 51, 61, 12, 12, 14, 19, 26, 58, 60, 55,
+    14, 13, 16, 24, 40, 57, 69, 56, 14, 17, 22, 29, 51, 87, 80, 62,
+    18, 22, 37, 56, 68, 109, 103, 77, 24, 35, 55, 64, 81, 104, 113, 92,
+    49, 64, 78, 87, 103, 121, 120, 101, 72, 92, 95, 98, 112, 100, 103, 99,
+)  # fmt: skip
+
+
+def flatten_toc(data) -> List[list]:
+    """把目录接口返回的树形数据展开为 set_toc 使用的 [层级, 标题, 页码] 列表"""
+    flat_toc = []
+    for item in data:
+        flat_toc.append([int(item["level"]), item["label"], int(item["pnum"])])
+        if not item["isLeaf"] and item["children"]:
+            flat_toc.extend(flatten_toc(item["children"]))
+    return flat_toc
+
+
+class EncodedPage(NamedTuple):
+    data: bytes
+    width: int
+    height: int
+    kind: str = "color"  # color 彩色 / gray 灰度 / bilevel 黑白
+    codec: str = "jpeg"  # jpeg / g4（CCITT G4 原始数据）/ png / file（直接嵌入 path 指向的 JPEG 文件）
+    baseline: int = 0  # 同一页按彩色 JPEG 编码的大小（仅抽样页面）
+    source_pixels: int = 0  # 裁剪前的像素数
+    path: str = ""
+
+
+def flatten_image(img: Image.Image) -> Image.Image:
+    """透明背景铺白，并统一为 RGB 或 L 模式"""
+    # 处理含有透明通道的PNG（转换为白色背景）
+    if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+        img = img.convert("RGBA")
+        background = Image.new("RGB", img.size, (255, 255, 255))
+        background.paste(img, mask=img.split()[-1])
+        return background
+    if img.mode not in ("RGB", "L"):
+        return img.convert("RGB")
+    return img
+
+
+def encode_jpeg(img: Image.Image, quality: int) -> bytes:
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=quality)
+    return buf.getvalue()
+
+
+def encode_g4(bw: Image.Image) -> Optional[bytes]:
+    """
+    把 1 位图编码为单条带的 CCITT G4 数据，可直接作为 PDF 的 CCITTFaxDecode 图片流；
+    Pillow 不支持（缺少 libtiff 或写出了多个条带）时返回 None
+    """
+    if not features.check("libtiff"):
+        return None
+    buf = io.BytesIO()
+    bw.save(buf, format="TIFF", compression="group4", strip_size=2**31 - 1)
+    with Image.open(buf) as tif:
+        offsets = tif.tag_v2.get(273)
+        counts = tif.tag_v2.get(279)
+        photometric = tif.tag_v2.get(262)
+    if offsets is None or len(offsets) != 1 or photometric != 1:
+        return None
+    return buf.getvalue()[offsets[0] : offsets[0] + counts[0]]
+
+
+def estimate_jpeg_quality(quantization: Dict[int, List[int]]) -> int:
+    """由亮度量化表估算 JPEG 的编码质量（按 libjpeg 的质量缩放公式反推）"""
+    scale = 100 * sum(quantization[0]) / sum(STD_LUMINANCE_TABLE)
+    quality = (200 - scale) / 2 if scale <= 100 else 5000 / scale
+    return int(round(min(100, max(1, quality))))
+
+
+def passthrough_jpeg(
+    img_path: str,
+    quality: int,
+    encoding: str,
+    crop_box: Optional[Box],
+    crop_tolerance: int,
+    baseline: bool,
+) -> Optional[EncodedPage]:
+    """
+    已经是 JPEG 的页面图片，在不需要转换颜色空间、裁剪或降低质量时原样嵌入：
+    尺寸、颜色空间和量化表只读取文件头，分类和裁剪检查使用 draft 模式解码的缩小图。
+    需要重新编码时返回 None
+    """
+    with Image.open(img_path) as img:
+        if img.format != "JPEG" or img.mode not in ("RGB", "L") or not img.quantization:
+            return None
+        if estimate_jpeg_quality(img.quantization) > quality:
+            return None  # 按更低的质量重新编码以减小文件
+        width, height = img.size
+        kind = "color" if img.mode == "RGB" else "gray"
+        if encoding != "rgb" or crop_box is not None:
+            img.draft(img.mode, (width // 8, height // 8))
+            if encoding != "rgb":
+                kind, _ = classify_page(img)
+                if (kind == "bilevel" and encoding == "auto") or (
+                    kind != "color" and img.mode == "RGB"
+                ):
+                    return None  # 黑白页、彩色 JPEG 中的灰度页需要换用更省空间的编码
+                if kind == "bilevel":
+                    kind = "gray"
+            if crop_box is not None and crop_to_box(img, crop_box, crop_tolerance) is not None:
+                return None  # 需要裁剪
+    size = os.path.getsize(img_path) if baseline else 0
+    return EncodedPage(b"", width, height, kind, "file", size, width * height, img_path)
+
+
+def prepare_page_image(
+    img: Image.Image,
+    encoding: str,
+    midtone_ratio: float,
+    crop_box: Optional[Box],
+    crop_tolerance: int,
+):
+    """透明背景铺白、裁剪并判断页面类型，返回 (图片, 类型, 灰度直方图, 裁剪前的像素数)"""
+    img = flatten_image(img)
+    source_pixels = img.width * img.height
+    if crop_box is not None:
+        img = crop_to_box(img, crop_box, crop_tolerance) or img
+    kind, hist = "color", None
+    if encoding != "rgb":
+        kind, hist = classify_page(img, midtone_ratio=midtone_ratio)
+        if kind == "bilevel" and encoding != "auto":
+            kind = "gray"
+    return img, kind, hist, source_pixels
+
+
+def encode_bilevel(img: Image.Image, hist) -> Tuple[bytes, str]:
+    """按 Otsu 阈值二值化后编码，返回 (数据, 编码方式)"""
+    threshold = otsu_threshold(hist)
+    bw = img.convert("L").point(lambda v: 255 if v > threshold else 0).convert("1")
+    data = encode_g4(bw)
+    if data is not None:
+        return data, "g4"
+    buf = io.BytesIO()
+    bw.save(buf, format="PNG")
+    return buf.getvalue(), "png"
+
+
+def encode_page_image(
+    img_path: str,
+    quality: int = 100,
+    encoding: str = "rgb",
+    midtone_ratio: float = 0.35,
+    baseline: bool = False,
+    crop_box: Optional[Box] = None,
+    crop_tolerance: int = 24,
+) -> EncodedPage:
+    """
+    解码页面图片，按 crop_box 裁去页边和截图边框后按 encoding 编码：
+    - rgb：全部编码为彩色 JPEG
+    - gray：灰度页面编码为 8 位灰度 JPEG
+    - auto：在 gray 的基础上，黑白文字页二值化后编码为 1 位 CCITT G4
+    baseline 为 True 时额外记录按彩色 JPEG 编码的大小。
+    已经是 JPEG 且无需转换的图片不解码，原样嵌入（见 passthrough_jpeg）
+    """
+    page = passthrough_jpeg(img_path, quality, encoding, crop_box, crop_tolerance, baseline)
+    if page is not None:
+        return page
+    with Image.open(img_path) as img:
+        img, kind, hist, source_pixels = prepare_page_image(
+            img, encoding, midtone_ratio, crop_box, crop_tolerance
+        )
+        codec = "jpeg"
+        if kind == "bilevel":
+            data, codec = encode_bilevel(img, hist)
+        elif kind == "gray":
+            data = encode_jpeg(img.convert("L"), quality)
+        else:
+            data = encode_jpeg(img.convert("RGB"), quality)
+        size = 0
+        if baseline:
+            size = len(data) if kind == "color" else len(encode_jpeg(img.convert("RGB"), quality))
+        return EncodedPage(
+            data, img.width, img.height, kind, codec, size, source_pixels, img_path
+        )
+
+
+class QualityProbe(NamedTuple):
+    kind: str
+    samples: List[Tuple[int, int, float]]  # (质量, 字节数, SSIM)，按质量升序
+    floor: int  # 满足 SSIM 下限的最低质量
+
+
+def probe_page_quality(
+    img_path: str,
+    max_quality: int = 100,
+    min_ssim: float = 0.95,
+    encoding: str = "rgb",
+    midtone_ratio: float = 0.35,
+    crop_box: Optional[Box] = None,
+    crop_tolerance: int = 24,
+    min_quality: int = 10,
+) -> QualityProbe:
+    """
+    二分查找满足 SSIM 下限的最低 JPEG 质量，同时记录查找过程中（以及 85、最高质量处）
+    每个质量对应的大小和 SSIM，作为该页的质量-大小曲线。黑白页的大小与质量无关
+    """
+    with Image.open(img_path) as img:
+        img, kind, hist, _ = prepare_page_image(
+            img, encoding, midtone_ratio, crop_box, crop_tolerance
+        )
+        if kind == "bilevel":
+            data, _ = encode_bilevel(img, hist)
+            return QualityProbe(kind, [(max_quality, len(data), 1.0)], max_quality)
+        img = img.convert("L" if kind == "gray" else "RGB")
+    reference = np.asarray(img.convert("L"))
+    samples = {}
+
+    def measure(quality: int) -> float:
+        data = encode_jpeg(img, quality)
+        with Image.open(io.BytesIO(data)) as decoded:
+            score = ssim(reference, np.asarray(decoded.convert("L")), stride=4)
+        samples[quality] = (len(data), score)
+        return score
+
+    lo, hi = min(min_quality, max_quality), max_quality
+    if measure(hi) < min_ssim:
+        floor = hi
+    elif measure(lo) >= min_ssim:
+        floor = lo
+    else:
+        while hi - lo > 2:
+            mid = (lo + hi) // 2
+            if measure(mid) >= min_ssim:
+                hi = mid
+            else:
+                lo = mid
+        floor = hi
+    if floor < 85 < max_quality and 85 not in samples:
+        measure(85)
+    return QualityProbe(
+        kind, [(q, size, score) for q, (size, score) in sorted(samples.items())], floor
+    )
+
+
+def probe_at(probe: QualityProbe, level: float) -> Tuple[int, float]:
+    """在该页的质量-大小曲线上找出 SSIM 达到 level 的最低质量（线性插值），返回 (质量, 预计字节数)"""
+    samples = [(q, size, score) for q, size, score in probe.samples if q >= probe.floor]
+    best = 0.0
+    prev = None
+    for q, size, score in samples:
+        best = max(best, score)  # 曲线按质量单调
+        if best >= level:
+            if prev is None or best == prev[2]:
+                return q, size
+            t = (level - prev[2]) / (best - prev[2])
+            return (
+                int(np.ceil(prev[0] + t * (q - prev[0]))),
+                prev[1] + t * (size - prev[1]),
+            )
+        prev = (q, size, best)
+    q, size, _ = samples[-1]
+    return q, size
+
+
+class TargetPlan:
+    """
+    目标大小模式：所有页面使用同一个 SSIM 水平，各页按自己的曲线取达到该水平的最低质量，
+    二分查找使总大小刚好不超过预算的 SSIM 水平（不低于 min_ssim）。
+    细节多的页面自然分到更多字节，纯文字页更少。
+    生成过程中按已追加页面的实际大小，定期为剩余页面重新分配
+    """
+
+    def __init__(self, probes: Dict[str, QualityProbe], budget: float, min_ssim: float):
+        self.probes = probes
+        self.budget = budget
+        self.min_ssim = min_ssim
+        self.qualities: Dict[str, int] = {}
+        self.actual: Dict[str, int] = {}
+        self.level = min_ssim
+        self.feasible = True  # 按 SSIM 下限编码时能否不超过目标大小
+        self.solve()
+        self.feasible = self.level > min_ssim or self._total(min_ssim) <= budget
+
+    def solve(self):
+        remaining = [path for path in self.probes if path not in self.actual]
+        budget = self.budget - sum(self.actual.values())
+
+        def total(level: float) -> float:
+            return self._total(level, remaining)
+
+        lo, hi = self.min_ssim, 1.0
+        if total(hi) <= budget:
+            lo = hi
+        elif total(lo) <= budget:
+            for _ in range(20):
+                mid = (lo + hi) / 2
+                if total(mid) <= budget:
+                    lo = mid
+                else:
+                    hi = mid
+        # total(min_ssim) 超出预算时无法达到目标，保持 SSIM 下限
+        self.level = lo
+        for path in remaining:
+            self.qualities[path] = probe_at(self.probes[path], lo)[0]
+
+    def _total(self, level: float, paths: Optional[List[str]] = None) -> float:
+        return sum(probe_at(self.probes[path], level)[1] for path in paths or self.probes)
+
+    def quality_for(self, img_path: str, default: int) -> int:
+        return self.qualities.get(img_path, default)
+
+    def record(self, img_path: str, size: int):
+        if img_path not in self.probes:
+            return
+        self.actual[img_path] = size
+        if len(self.actual) % REPLAN_EVERY == 0 and len(self.actual) < len(self.probes):
+            self.solve()
+
+
+class PdfBuilder:
+    """
+    按页码顺序把页面图片追加到内存中的 PDF 文档，最后一次性保存。
+    workers > 1 时图片的解码和编码在进程池中并行进行，本进程只按顺序插入页面
+    """
+
+    def __init__(
+        self,
+        quality: int = 100,
+        workers: int = 1,
+        encoding: str = "rgb",
+        midtone_ratio: float = 0.35,
+        auto_crop: bool = False,
+        crop_box: Optional[Box] = None,
+        crop_tolerance: int = 24,
+        crop_margin: float = 0.01,
+        crop_samples: int = 24,
+        target_bytes: int = 0,
+        min_ssim: float = 0.95,
+    ):
+        self.quality = quality
+        self.workers = workers
+        self.encoding = encoding
+        self.midtone_ratio = midtone_ratio
+        self.auto_crop = auto_crop
+        self.crop_box = crop_box  # 整本书统一的裁剪框，为 None 时由 prepare_crop 计算
+        self.crop_tolerance = crop_tolerance
+        self.crop_margin = crop_margin
+        self.crop_samples = crop_samples
+        self.crop_prepared = crop_box is not None or not auto_crop
+        self.target_bytes = target_bytes  # 目标大小模式的目标字节数（0 为关闭）
+        self.min_ssim = min_ssim
+        self.target: Optional[TargetPlan] = None
+        self.executor = ProcessPoolExecutor(workers) if workers > 1 else None
+        self.doc = fitz.open()
+        self.submitted = 0
+        # 按页面类型统计：页数、字节数、抽样页面的实际字节数和彩色 JPEG 字节数
+        self.stats: Dict[str, Dict[str, int]] = {}
+        self.pixels = {"source": 0, "encoded": 0, "cropped": 0}
+        # 编码结果的哈希 -> 图片对象 xref，相同的页面图片只保存一次
+        self.image_xrefs: Dict[str, int] = {}
+        self.dedup = {"pages": 0, "bytes": 0}
+        self.passthrough = 0  # 未重新编码、原样嵌入的 JPEG 页数
+
+    @property
+    def pages(self) -> int:
+        return self.doc.page_count
+
+    def _encode_args(self, img_path: str):
+        self.submitted += 1
+        return (
+            img_path,
+            self.target.quality_for(img_path, self.quality) if self.target else self.quality,
+            self.encoding,
+            self.midtone_ratio,
+            self.encoding != "rgb" and self.submitted % BASELINE_SAMPLE_EVERY == 1,
+            self.crop_box if self.auto_crop else None,
+            self.crop_tolerance,
+        )
+
+    def plan_target_size(self, img_paths: List[str]):
+        """目标大小模式：并行探测每页的质量-大小曲线，为每页分配质量"""
+        if not self.target_bytes or not img_paths:
+            return
+        args = [
+            (
+                img_path,
+                self.quality,
+                self.min_ssim,
+                self.encoding,
+                self.midtone_ratio,
+                self.crop_box if self.auto_crop else None,
+                self.crop_tolerance,
+            )
+            for img_path in img_paths
+        ]
+        if self.executor is None:
+            probes = [probe_page_quality(*arg) for arg in args]
+        else:
+            probes = list(self.executor.map(probe_page_quality, *zip(*args)))
+        written = sum(stats["bytes"] for stats in self.stats.values())
+        budget = self.target_bytes - written - PAGE_OVERHEAD * (self.pages + len(img_paths))
+        self.target = TargetPlan(dict(zip(img_paths, probes)), budget, self.min_ssim)
+
+    def prepare_crop(self, img_paths: List[str]):
+        """由已有的页面抽样计算裁剪框（只计算一次，之后所有页面使用同一裁剪框）"""
+        if self.crop_prepared:
+            return
+        self.crop_prepared = True
+        self.crop_box = sample_crop_box(
+            img_paths, self.crop_samples, self.crop_tolerance, self.crop_margin
+        )
+
+    def _insert_g4(self, pdf_page, page: EncodedPage) -> int:
+        # insert_image 会把 TIFF 解码后重新压缩，这里直接写入 G4 数据流
+        w, h = page.width, page.height
+        xref = self.doc.get_new_xref()
+        self.doc.update_object(
+            xref,
+            f"<</Type/XObject/Subtype/Image/Width {w}/Height {h}/BitsPerComponent 1/ColorSpace/DeviceGray>>",
+        )
+        self.doc.update_stream(xref, page.data, compress=False)
+        self.doc.xref_set_key(xref, "Filter", "/CCITTFaxDecode")
+        self.doc.xref_set_key(
+            xref, "DecodeParms", f"<</K -1/Columns {w}/Rows {h}/BlackIs1 true>>"
+        )
+        pdf_page.insert_image(rect=(0, 0, w, h), xref=xref)
+        return xref
+
+    def add_page(self, page: EncodedPage, pno: int = -1):
+        """追加页面；pno 不为 -1 时插入到该位置之前"""
+        pdf_page = self.doc.new_page(pno, width=page.width, height=page.height)
+        rect = (0, 0, page.width, page.height)
+        # 像素相同的页面编码结果也相同（空白页、分隔页、重复的插图），直接引用已保存的图片对象
+        if page.codec == "file":
+            digest, size = file_hash(page.path), os.path.getsize(page.path)
+        else:
+            digest, size = content_hash(page.data), len(page.data)
+        xref = self.image_xrefs.get(digest)
+        if xref is not None:
+            pdf_page.insert_image(rect=rect, xref=xref)
+            self.dedup["pages"] += 1
+            self.dedup["bytes"] += size
+        elif page.codec == "g4":
+            self.image_xrefs[digest] = self._insert_g4(pdf_page, page)
+        elif page.codec == "file":
+            # MuPDF 直接读取 JPEG 文件，以 DCTDecode 原样嵌入
+            self.image_xrefs[digest] = pdf_page.insert_image(rect=rect, filename=page.path)
+            self.passthrough += 1
+        else:
+            self.image_xrefs[digest] = pdf_page.insert_image(rect=rect, stream=page.data)
+        stats = self.stats.setdefault(
+            page.kind, {"pages": 0, "bytes": 0, "sampled": 0, "baseline": 0}
+        )
+        stats["pages"] += 1
+        stats["bytes"] += 0 if xref is not None else size
+        if page.baseline:
+            stats["sampled"] += size
+            stats["baseline"] += page.baseline
+        if self.target is not None:
+            self.target.record(page.path, 0 if xref is not None else size)
+        self.pixels["source"] += page.source_pixels
+        self.pixels["encoded"] += page.width * page.height
+        if page.width * page.height < page.source_pixels:
+            self.pixels["cropped"] += 1
+
+    def add_image_file(self, img_path: str):
+        self.add_page(encode_page_image(*self._encode_args(img_path)))
+
+    def params(self) -> dict:
+        """影响编码结果的参数，参数相同时同一张图片生成的页面相同"""
+        return {name: getattr(self, name) for name in ENCODE_PARAMS}
+
+    def summary(self) -> Optional[str]:
+        """各类页面的数量、大小，以及与全部编码为彩色 JPEG 相比估计节省的空间"""
+        if not self.stats:
+            return None
+        parts, saved = [], 0.0
+        for kind, name in PAGE_KIND_NAMES.items():
+            stats = self.stats.get(kind)
+            if stats is None:
+                continue
+            parts.append(f"{name} {stats['pages']} 页 {stats['bytes'] / 1024 / 1024:.1f} MB")
+            if stats["sampled"]:
+                saved += stats["bytes"] * (stats["baseline"] / stats["sampled"] - 1)
+        line = "PDF 页面编码：" + "，".join(parts)
+        if self.encoding != "rgb":
+            line += f"；估计比全部使用彩色 JPEG 节省 {saved / 1024 / 1024:.1f} MB"
+        qualities = [
+            quality
+            for path, quality in (self.target.qualities.items() if self.target else ())
+            if self.target.probes[path].kind != "bilevel"
+        ]
+        if qualities:
+            line += (
+                f"\n目标大小：SSIM 水平 {self.target.level:.3f}，"
+                f"JPEG 质量 {min(qualities)}-{max(qualities)}（平均 {sum(qualities) / len(qualities):.0f}）"
+            )
+            if not self.target.feasible:
+                line += f"；按 SSIM 下限 {self.min_ssim} 编码仍超出目标大小"
+        if self.passthrough:
+            line += f"\n{self.passthrough} 页 JPEG 图片未重新编码，原样嵌入"
+        if self.dedup["pages"]:
+            line += (
+                f"\n重复页面：{self.dedup['pages']} 页共用已保存的图片，"
+                f"节省 {self.dedup['bytes'] / 1024 / 1024:.1f} MB"
+            )
+        if self.pixels["cropped"]:
+            line += (
+                f"\n自动裁剪：{self.pixels['cropped']} 页，"
+                f"像素减少 {1 - self.pixels['encoded'] / self.pixels['source']:.0%}"
+            )
+        return line
+
+    def encode_images(self, img_paths: Iterable[str]) -> Iterator[EncodedPage]:
+        """按顺序编码多张图片；使用进程池时最多同时编码 workers * 2 张，控制内存占用"""
+        if self.executor is None:
+            for img_path in img_paths:
+                yield encode_page_image(*self._encode_args(img_path))
+            return
+        pending = deque()
+        try:
+            for img_path in img_paths:
+                pending.append(
+                    self.executor.submit(encode_page_image, *self._encode_args(img_path))
+                )
+                if len(pending) >= self.workers * 2:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def add_image_files(self, img_paths: Iterable[str]):
+        for page in self.encode_images(img_paths):
+            self.add_page(page)
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+            self.executor = None
+
+    def close(self):
+        """关闭文档并停止进程池；出错时也要调用，否则打开的文件一直被占用（已保存时不影响）"""
+        if not self.doc.is_closed:
+            self.doc.close()
+        self.shutdown()
+
+    def truncate(self, pages: int):
+        """删除 pages 之后的页面"""
+        if self.doc.page_count > pages:
+            self.doc.delete_pages(pages, self.doc.page_count - 1)
+
+    def save(self, output_path: str, toc: Optional[List[list]] = None):
+        """保存 PDF；toc 在唯一一次保存之前写入（页面齐全后才能写入，否则超出的页码会被截断）"""
+        if toc is not None:
+            self.doc.set_toc(toc)
+        # 保存PDF时启用压缩和优化选项
+        self.doc.save(
+            output_path,
+            garbage=3,  # 删除未使用的对象
+            deflate=True,  # 启用压缩
+            clean=True,  # 优化文件结构
+        )
+        self.doc.close()
+        self.image_xrefs = {}  # 保存时对象已重新编号，原来的 xref 不再有效
+        self.shutdown()
+
+
+class ChunkedPdfBuilder(PdfBuilder):
+    """
+    内存占用有上限的 PdfBuilder：每追加 chunk_pages 页就把新页面增量保存到工作文件 work_path，
+    然后重新打开（已保存的页面只在需要时从磁盘读取），内存占用与书的页数无关。
+    已保存的页面记录在 work_path + ".json" 中（每页图片的哈希和编码参数），
+    生成中断后重新开始时，从最后一次保存的位置继续；图片发生变化的页面之后的部分重新生成。
+    """
+
+    def __init__(
+        self,
+        work_path: str,
+        chunk_pages: int = 100,
+        page_key: Optional[Callable[[int], Optional[str]]] = None,
+        **kwargs,
+    ):
+        super().__init__(**kwargs)
+        self.work_path = work_path
+        self.state_path = work_path + ".json"
+        self.chunk_pages = chunk_pages
+        self.page_key = page_key or (lambda page_num: None)
+        self.keys: List[Optional[str]] = []  # 已追加的每页图片的哈希
+        self.resumed = self._resume()
+
+    def _resume(self) -> int:
+        """读取上次保存的进度，返回可以沿用的页数"""
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+            if state["params"] != self.params():
+                return 0
+            doc = fitz.open(self.work_path)
+        except Exception:
+            return 0
+        if doc.is_repaired or not doc.can_save_incrementally():
+            doc.close()  # 上次保存时中断，文件已损坏
+            return 0
+        keys = state["keys"][: doc.page_count]
+        valid = 0
+        while valid < len(keys) and keys[valid] == self.page_key(valid + 1):
+            valid += 1
+        if valid == 0:
+            doc.close()
+            return 0
+        self.doc.close()
+        self.doc = doc
+        self.keys = keys[:valid]
+        self.truncate(valid)
+        if state["crop_prepared"]:
+            self.crop_box = tuple(state["crop_box"]) if state["crop_box"] else None
+            self.crop_prepared = True
+        self.image_xrefs = state["image_xrefs"]
+        self.stats, self.pixels, self.dedup = state["stats"], state["pixels"], state["dedup"]
+        self.passthrough = state.get("passthrough", 0)
+        return valid
+
+    def add_page(self, page: EncodedPage, pno: int = -1):
+        super().add_page(page, pno)
+        self.keys.append(self.page_key(self.pages))
+        if self.pages % self.chunk_pages == 0:
+            self.flush()
+
+    def truncate(self, pages: int):
+        super().truncate(pages)
+        del self.keys[pages:]
+
+    def flush(self):
+        """把新追加的页面保存到工作文件，重新打开以释放内存，并记录进度"""
+        if self.doc.name:
+            self.doc.save(
+                self.doc.name,
+                incremental=True,
+                encryption=fitz.PDF_ENCRYPT_KEEP,
+                deflate=True,
+            )
+        else:
+            temp_path = self.work_path + ".tmp"
+            self.doc.save(temp_path, deflate=True)
+            os.replace(temp_path, self.work_path)
+        self.doc.close()
+        self.doc = fitz.open(self.work_path)
+        # 先保存页面再记录进度，中断时进度不会超过实际保存的页面
+        atomic_write_json(
+            self.state_path,
+            {
+                "params": self.params(),
+                "keys": self.keys,
+                "crop_prepared": self.crop_prepared,
+                "crop_box": self.crop_box,
+                "image_xrefs": self.image_xrefs,
+                "stats": self.stats,
+                "pixels": self.pixels,
+                "dedup": self.dedup,
+                "passthrough": self.passthrough,
+            },
+        )
+
+    def save(self, output_path: str, toc: Optional[List[list]] = None):
+        """增量保存剩余页面和目录，然后把工作文件移动到 output_path（不再整体重写一遍）"""
+        if toc is not None:
+            self.doc.set_toc(toc)
+        self.flush()
+        self.doc.close()
+        os.replace(self.work_path, output_path)
+        os.remove(self.state_path)
+        self.shutdown()
+
+
+class PdfPatcher(PdfBuilder):
+    """
+    在已生成的 PDF 上增量修改：替换图片发生变化的页面、在末尾追加新页面，
+    修改后重新写入目录，并以增量保存的方式只把改动的对象追加到文件末尾
+    """
+
+    def __init__(self, pdf_path: str, image_xrefs: Optional[Dict[str, int]] = None, **kwargs):
+        super().__init__(**kwargs)
+        self.doc.close()
+        self.doc = fitz.open(pdf_path)
+        self.image_xrefs = dict(image_xrefs or {})
+        self.toc = self.doc.get_toc()  # 替换页面会使原目录指向已删除的页面，保存时重新写入
+        self.replaced = 0
+
+    def can_patch(self) -> bool:
+        return not self.doc.is_repaired and self.doc.can_save_incrementally()
+
+    def replace_images(self, images: Dict[int, str]):
+        """用新图片替换指定页码（从 1 开始）的页面"""
+        page_nums = sorted(images)
+        for page_num, page in zip(page_nums, self.encode_images(images[n] for n in page_nums)):
+            self.add_page(page, pno=page_num - 1)
+            self.doc.delete_page(page_num)
+            self.replaced += 1
+
+    def save(self, output_path: str, toc: Optional[List[list]] = None):
+        self.doc.set_toc(toc if toc is not None else self.toc)
+        self.doc.save(
+            self.doc.name,
+            incremental=True,
+            encryption=fitz.PDF_ENCRYPT_KEEP,
+            deflate=True,
+        )
+        self.doc.close()
+        self.shutdown()
+
+
+class StreamingPdfBuilder:
+    """
+    与截图并行生成 PDF：写盘线程每写完一页就通知 page_ready，后台线程按页码顺序
+    编码并追加到 PdfBuilder，乱序到达的页面先记下，等前面的页面到齐后再追加。
+    截图结束后调用 close 等待已到齐的页面追加完毕，整本书的耗时接近 max(截图, 编码)。
+    需要计算裁剪框时，要等 sample_pages 都截取完才开始追加（截图时应优先截取这些页面）。
+    """
+
+    def __init__(
+        self,
+        builder: PdfBuilder,
+        find_image: Callable[[int], Optional[str]],
+        sample_pages: Iterable[int] = (),
+        on_error: Optional[Callable[[Exception], None]] = None,
+    ):
+        self.builder = builder
+        self.find_image = find_image
+        self.on_error = on_error  # 后台生成出错时的通知（之后的页面留到截图结束后再生成）
+        # 需要计算裁剪框时，先等到均匀分布在整本书中的抽样页都到齐（只用开头几页会抽到封面、前言）
+        self.sample_pages: Set[int] = set() if builder.crop_prepared else set(sample_pages)
+        self._arrived: Set[int] = set()
+        self.error: Optional[Exception] = None
+        self._ready: Set[int] = set()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    @property
+    def next_page(self) -> int:
+        return self.builder.pages + 1
+
+    def page_ready(self, page_num: int):
+        with self._cond:
+            self._ready.add(page_num)
+            self._arrived.add(page_num)
+            self._cond.notify_all()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._closed and (
+                    self.next_page not in self._ready or not self.sample_pages <= self._arrived
+                ):
+                    self._cond.wait()
+                # 截图结束时抽样页仍不齐，裁剪框留给调用方按全部页面计算
+                if self.next_page not in self._ready or not self.sample_pages <= self._arrived:
+                    return
+                sample = sorted(self.sample_pages) if not self.builder.crop_prepared else None
+                # 取出从 next_page 开始连续到齐的所有页面，一起交给进程池编码
+                batch = []
+                page_num = self.next_page
+                while page_num in self._ready:
+                    self._ready.discard(page_num)
+                    batch.append(page_num)
+                    page_num += 1
+            try:
+                if sample is not None:
+                    self.sample_pages = set()
+                    self.builder.prepare_crop([self.find_image(n) for n in sample])
+                self.builder.add_image_files(self.find_image(n) for n in batch)
+            except Exception as e:
+                self.error = e
+                if self.on_error is not None:
+                    self.on_error(e)
+                return
+
+    def close(self):
+        """停止后台线程，返回时所有已到齐的页面都已追加（出错的页面留给调用方重新追加）"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
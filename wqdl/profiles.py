@@ -0,0 +1,117 @@
+import os
+import time
+import shutil
+import threading
+from typing import Dict, List
+
+# 浏览器运行时创建的锁文件，上次异常退出时可能残留
+LOCK_FILES = (
+    "SingletonLock",
+    "SingletonCookie",
+    "SingletonSocket",
+    "lockfile",
+    "lock",
+    ".parentlock",
+    "parent.lock",
+)
+
+_PENDING = object()  # 槽位已分配、浏览器尚未启动完成
+
+
+def dir_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class BrowserProfileManager:
+    """
+    管理截图浏览器的持久化配置目录（user-data-dir）和磁盘缓存目录，
+    使阅读器的 JS、CSS、字体等静态资源在多本书、浏览器重启和多个并行 worker 之间命中本地缓存。
+
+    每种浏览器有若干个槽位（slotN/profile、slotN/cache），同一时间每个槽位只给一个浏览器使用
+    （浏览器不允许多个进程共用同一个配置目录）。新建的槽位复制最近使用的槽位的缓存作为种子，
+    总大小超过 max_mb 时按最近使用时间淘汰空闲的槽位。
+    """
+
+    def __init__(self, root: str, max_mb: int = 512):
+        self.root = root
+        self.max_bytes = max_mb * 1024 * 1024
+        self._lock = threading.Lock()
+        self._owners: Dict[str, object] = {}
+
+    @staticmethod
+    def _driver_alive(driver) -> bool:
+        if driver is _PENDING:
+            return True
+        process = getattr(getattr(driver, "service", None), "process", None)
+        return process is not None and process.poll() is None
+
+    def _slots(self, base: str) -> List[str]:
+        if not os.path.isdir(base):
+            return []
+        return [os.path.join(base, name) for name in os.listdir(base) if name.startswith("slot")]
+
+    def _idle(self, slot: str) -> bool:
+        owner = self._owners.get(slot)
+        return owner is None or not self._driver_alive(owner)
+
+    def _evict(self, base: str):
+        """总大小超过上限时，删除最久未使用的空闲槽位"""
+        slots = sorted(self._slots(base), key=os.path.getmtime)
+        sizes = {slot: dir_size(slot) for slot in slots}
+        total = sum(sizes.values())
+        for slot in slots:
+            if total <= self.max_bytes:
+                break
+            if self._idle(slot):
+                shutil.rmtree(slot, ignore_errors=True)
+                self._owners.pop(slot, None)
+                total -= sizes[slot]
+
+    def acquire(self, browser_type: str) -> str:
+        """分配一个空闲槽位，返回槽位目录（其中 profile 为配置目录、cache 为磁盘缓存目录）"""
+        base = os.path.abspath(os.path.join(self.root, browser_type))
+        with self._lock:
+            self._evict(base)
+            i = 0
+            while not self._idle(os.path.join(base, f"slot{i}")):
+                i += 1
+            slot = os.path.join(base, f"slot{i}")
+            self._owners[slot] = _PENDING
+            seeds = [s for s in self._slots(base) if s != slot and os.path.isdir(os.path.join(s, "cache"))]
+
+        profile_dir = os.path.join(slot, "profile")
+        cache_dir = os.path.join(slot, "cache")
+        os.makedirs(profile_dir, exist_ok=True)
+        for name in LOCK_FILES:
+            path = os.path.join(profile_dir, name)
+            if os.path.lexists(path):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+        if not os.path.isdir(cache_dir) and seeds:
+            # 新槽位：复制最近使用的槽位的缓存
+            seed = max(seeds, key=os.path.getmtime)
+            try:
+                shutil.copytree(os.path.join(seed, "cache"), cache_dir, dirs_exist_ok=True)
+            except OSError:
+                pass  # 缓存文件正被其他浏览器写入时可能复制失败，不影响使用
+        os.makedirs(cache_dir, exist_ok=True)
+        os.utime(slot, (time.time(), time.time()))
+        return slot
+
+    def bind(self, slot: str, driver):
+        """记录占用槽位的浏览器；浏览器退出后槽位自动变为空闲"""
+        with self._lock:
+            self._owners[slot] = driver
+
+    def release(self, slot: str):
+        with self._lock:
+            self._owners.pop(slot, None)
@@ -0,0 +1,111 @@
+import time
+import threading
+from typing import Callable, Dict, Hashable, List
+
+
+class PooledSession:
+    def __init__(self, key: Hashable, driver):
+        self.key = key
+        self.driver = driver
+        self.uses = 0
+        self.primed_domains = set()  # 已加载过登录 cookies 的域名
+        self.created_at = time.time()
+
+
+class DriverPool:
+    """
+    浏览器会话池：在一批书籍（多卷）的下载过程中复用已启动、已登录的浏览器，
+    避免每一卷都重新启动浏览器和加载 cookies。
+
+    - 取出时做健康检查，失效的浏览器直接丢弃
+    - 每个浏览器最多服务 max_uses 次、最长存活 max_age 秒，之后回收重建
+    - 空闲的浏览器最多保留 max_idle 个
+    """
+
+    def __init__(self, max_uses: int = 20, max_age: float = 3600, max_idle: int = 4):
+        self.max_uses = max_uses
+        self.max_age = max_age
+        self.max_idle = max_idle
+        self._lock = threading.Lock()
+        self._idle: List[PooledSession] = []
+        self._sessions: Dict[int, PooledSession] = {}
+
+    @staticmethod
+    def is_healthy(driver) -> bool:
+        try:
+            driver.execute_script("return document.readyState")
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _quit(driver):
+        try:
+            driver.quit()
+        except Exception:
+            pass
+
+    def _expired(self, session: PooledSession) -> bool:
+        return session.uses >= self.max_uses or time.time() - session.created_at > self.max_age
+
+    def acquire(self, key: Hashable, factory: Callable[[], object]):
+        """取出一个 key 匹配的健康浏览器，没有时调用 factory 新建"""
+        while True:
+            with self._lock:
+                session = next((s for s in self._idle if s.key == key), None)
+                if session is not None:
+                    self._idle.remove(session)
+            if session is None:
+                break
+            if not self._expired(session) and self.is_healthy(session.driver):
+                return session.driver
+            self.discard(session.driver)
+        driver = factory()
+        with self._lock:
+            self._sessions[id(driver)] = PooledSession(key, driver)
+        return driver
+
+    def release(self, driver, reuse: bool = True):
+        """归还浏览器；reuse=False、超过使用次数或空闲池已满时直接关闭"""
+        with self._lock:
+            session = self._sessions.get(id(driver))
+            if session is not None:
+                session.uses += 1
+                if reuse and not self._expired(session) and len(self._idle) < self.max_idle:
+                    self._idle.append(session)
+                    return
+        self.discard(driver)
+
+    def discard(self, driver):
+        with self._lock:
+            self._sessions.pop(id(driver), None)
+        self._quit(driver)
+
+    def is_primed(self, driver, domain: str) -> bool:
+        session = self._sessions.get(id(driver))
+        return session is not None and domain in session.primed_domains
+
+    def mark_primed(self, driver, domain: str):
+        session = self._sessions.get(id(driver))
+        if session is not None:
+            session.primed_domains.add(domain)
+
+    def invalidate(self):
+        """登录状态变化（重新登录）后，所有浏览器都需要重新加载 cookies"""
+        with self._lock:
+            for session in self._sessions.values():
+                session.primed_domains.clear()
+
+    def close(self):
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+            self._idle.clear()
+        for session in sessions:
+            self._quit(session.driver)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -1,6 +1,8 @@
 import os
 import json
+import uuid
 import atexit
+import multiprocessing
 from typing import Literal, Optional, Any, MutableMapping
 
 
@@ -45,8 +47,12 @@ class JsonProxy(MutableMapping):
         self._JsonProxy__mode = mode
         self._JsonProxy__save_after_change_count = save_after_change_count
         self._JsonProxy__change_count = 0
+        # 进程池的子进程（Windows 上为 spawn）会重新导入主模块并创建同一个配置，
+        # 子进程只读取，不写回，避免用启动时的旧数据覆盖主进程保存的配置
+        self._JsonProxy__child = multiprocessing.parent_process() is not None
         self.load()
-        atexit.register(self.save)  # 在程序退出时保存数据
+        if not self._JsonProxy__child:
+            atexit.register(self.save)  # 在程序退出时保存数据
 
     def load(self):
         """
@@ -74,9 +80,10 @@ class JsonProxy(MutableMapping):
     def save(self):
         """
         Save the current instance's non-private attributes to the JSON file,
-        respecting the mode setting. If the mode is "r", this method does nothing.
+        respecting the mode setting. If the mode is "r", or the instance lives in a
+        child process, this method does nothing.
         """
-        if self._JsonProxy__mode == "r":
+        if self._JsonProxy__mode == "r" or self._JsonProxy__child:
             return
         data = {key: value for key, value in self.__dict__.items() if not key.startswith("_JsonProxy_")}
         os.makedirs(os.path.dirname(self._JsonProxy__json_file) or "./", exist_ok=True)
@@ -242,3 +249,34 @@ class JsonProxy(MutableMapping):
         Return a string representation of all non-private attributes of the instance.
         """
         return str({key: value for key, value in self.__dict__.items() if not key.startswith("_JsonProxy_")})
+
+
+def atomic_write(path: str, data: bytes):
+    """
+    Write bytes to a file atomically: the data is written to a temporary file
+    next to the target, flushed to disk, and then renamed over the target, so
+    a crash never leaves a truncated file behind.
+
+    Args:
+        path (str): Destination file path.
+        data (bytes): Content to write.
+    """
+    os.makedirs(os.path.dirname(path) or "./", exist_ok=True)
+    # 每次写入使用不同的临时文件名，多个线程同时写同一文件时互不干扰
+    temp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+
+def atomic_write_json(path: str, data: Any):
+    """
+    Serialize data as JSON and write it atomically (see atomic_write).
+
+    Args:
+        path (str): Destination file path.
+        data (Any): JSON-serializable data.
+    """
+    atomic_write(path, json.dumps(data, ensure_ascii=False, indent=2).encode("utf-8"))